@@ -0,0 +1,561 @@
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from brewgen import random_function, random_source
+from brewlex import build_lexer
+from brewparse import parse_program
+from brewscan import scan
+from element import Element
+from intbase import BufferedSink, ConsoleSink, FileSource, MappedFileSource
+from interpreterv4 import Interpreter
+from parse_cachev4 import ParseCache
+from type_valuev4 import Object, Type, Value, int_value
+
+# Each benchmark is a brewin program and the number of operations it times,
+# so results are reported per operation as well as in total.
+BENCHMARKS = {}
+
+
+def benchmark(name, ops, program):
+    BENCHMARKS[name] = (ops, program)
+
+
+# by-value calls passing and returning primitives
+benchmark(
+    "call_int",
+    100000,
+    """
+func id(a, b) { return a; }
+func main() {
+  i = 0;
+  while (i < 100000) { i = id(i, 7) + 1; }
+  print(i);
+}
+""",
+)
+
+benchmark(
+    "call_string",
+    100000,
+    """
+func id(s) { return s; }
+func main() {
+  i = 0;
+  s = "some string that gets passed around";
+  while (i < 100000) { s = id(s); i = i + 1; }
+  print(i);
+}
+""",
+)
+
+# an object with a few fields and methods is copied on every call and return
+benchmark(
+    "call_object",
+    20000,
+    """
+func id(o) { return o; }
+func main() {
+  o = @;
+  o.x = 1;
+  o.y = "y";
+  inner = @;
+  inner.z = 3;
+  o.inner = inner;
+  o.get = lambda() { return this.x; };
+  o.set = lambda(v) { this.x = v; };
+  i = 0;
+  while (i < 20000) { o = id(o); i = i + 1; }
+  print(o.get());
+}
+""",
+)
+
+# closures created in a scope with a few variables, passed by value
+benchmark(
+    "call_closure",
+    20000,
+    """
+func apply(f, x) { return f(x); }
+func main() {
+  a = 1;
+  b = "b";
+  c = @;
+  c.v = 4;
+  f = lambda(x) { return x + a; };
+  i = 0;
+  while (i < 20000) { i = apply(f, i); }
+  print(i);
+}
+""",
+)
+
+# lambdas created in a loop while a few frames of other variables are live
+benchmark(
+    "make_lambda",
+    10000,
+    """
+func work(depth, a, b, c, d) {
+  if (depth > 0) { return work(depth - 1, a + 1, b, c, d); }
+  total = 0;
+  i = 0;
+  while (i < 10000) {
+    add = lambda(x) { return x + i; };
+    total = total + add(1);
+    i = i + 1;
+  }
+  return total;
+}
+func main() {
+  o = @;
+  o.name = "some object";
+  print(work(20, 0, "a string", o, lambda() { return 1; }));
+}
+""",
+)
+
+benchmark(
+    "fib",
+    21891,  # calls made by fib(20)
+    """
+func fib(n) {
+  if (n < 2) { return n; }
+  return fib(n - 1) + fib(n - 2);
+}
+func main() { print(fib(20)); }
+""",
+)
+
+# variables of main read from deep inside a recursion, so every lookup
+# passes the scopes of all the frames above it unless bindings are shallow
+benchmark(
+    "deep_recursion",
+    10010,  # calls made
+    """
+func sum(n) {
+  if (n == 0) { return 0; }
+  return step + sum(n - 1);
+}
+func main() {
+  step = 2;
+  total = 0;
+  i = 0;
+  while (i < 10) { total = total + sum(1000); i = i + 1; }
+  print(total);
+}
+""",
+)
+
+benchmark(
+    "deep_loop",
+    20000,  # loop iterations
+    """
+func walk(n) {
+  if (n > 0) { return 1 + walk(n - 1); }
+  s = 0;
+  i = 0;
+  while (i < limit) { s = s + base; i = i + 1; }
+  return s;
+}
+func main() {
+  base = 3;
+  limit = 20000;
+  print(walk(300));
+}
+""",
+)
+
+# a report built by appending to a string, printed once
+benchmark(
+    "concat",
+    40000,  # appends
+    """
+func main() {
+  s = "";
+  i = 0;
+  while (i < 20000) { s = s + "line of the report" + ", "; i = i + 1; }
+  print(s);
+}
+""",
+)
+
+# objects built alike, read through their fields and a shared prototype
+benchmark(
+    "objects",
+    20000,
+    """
+func main() {
+  p = @;
+  p.kind = "point";
+  o = nil;
+  i = 0;
+  total = 0;
+  while (i < 20000) {
+    o = @;
+    o.proto = p;
+    o.x = i;
+    o.y = 2;
+    o.z = 3;
+    total = total + o.x + o.y + o.z;
+    i = i + 1;
+  }
+  print(total, " ", o.kind);
+}
+""",
+)
+
+# fields and methods inherited through a deep prototype chain
+benchmark(
+    "proto_chain",
+    20000,
+    """
+func main() {
+  base = @;
+  base.size = 1;
+  base.grow = lambda(n) { return n + this.size; };
+  a = @; a.proto = base; a.a = 1;
+  b = @; b.proto = a; b.b = 2;
+  c = @; c.proto = b; c.c = 3;
+  d = @; d.proto = c; d.d = 4;
+  e = @; e.proto = d; e.e = 5;
+  obj = @; obj.proto = e;
+  i = 0;
+  total = 0;
+  while (i < 20000) {
+    total = obj.grow(total) + obj.size + obj.a;
+    i = i + 1;
+  }
+  print(total);
+}
+""",
+)
+
+
+def run_benchmark(name, engine, repeat, environment="shallow", unboxed=False):
+    ops, program = BENCHMARKS[name]
+    best = None
+    for _ in range(repeat):
+        interpreter = Interpreter(
+            console_output=False, engine=engine, environment=environment, unboxed=unboxed
+        )
+        start = time.perf_counter()
+        interpreter.run(program)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, ops
+
+
+# builds count objects the way o = @; o.proto = p; o.x = ...; o.y = ...;
+# o.z = ... does, without running a program, and reads their fields back.
+# Returns the seconds taken by each part and the bytes held per object,
+# which are measured on a second build as tracing slows it down.
+def object_model_benchmark(count):
+    proto = Value(Type.OBJECT, Object())
+    proto.v.addOrUpdate("kind", Value(Type.STRING, "point"))
+
+    def build():
+        objects = []
+        for i in range(count):
+            obj = Object()
+            obj.setProto(proto)
+            obj.addOrUpdate("x", int_value(i))
+            obj.addOrUpdate("y", int_value(2))
+            obj.addOrUpdate("z", int_value(3))
+            objects.append(obj)
+        return objects
+
+    start = time.perf_counter()
+    objects = build()
+    built = time.perf_counter()
+    for obj in objects:
+        obj.getObj("x")
+        obj.getObj("z")
+        obj.getObj("kind")
+    read = time.perf_counter()
+    del objects
+    tracemalloc.start()
+    objects = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return built - start, read - built, size / count
+
+
+# returns the bytes taken by what build() returns
+def traced_size(build):
+    tracemalloc.start()
+    kept = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+# returns the bytes per Value, per object with three fields and per node of
+# a parsed program with count / 10 statements
+def memory_benchmark(count):
+    big = 10**9  # not one of the shared small ints
+    values = [None] * count
+
+    def build_values():
+        for i in range(count):
+            values[i] = Value(Type.INT, big)
+
+    value_size = traced_size(build_values) / count
+    objects = [None] * count
+
+    def build_objects():
+        for i in range(count):
+            obj = Object()
+            obj.addOrUpdate("x", values[i])
+            obj.addOrUpdate("y", values[i])
+            obj.addOrUpdate("z", values[i])
+            objects[i] = obj
+
+    object_size = traced_size(build_objects) / count
+    statements = "\n".join(f"  x{i} = x{i - 1} + {i} * 2;" for i in range(1, count // 10))
+    program = f"func main() {{\n  x0 = 0;\n{statements}\n  print(x0);\n}}"
+    node_size = traced_size(lambda: parse_program(program)) / count_nodes(parse_program(program))
+    return value_size, object_size, node_size
+
+
+# runs a program printing count lines to /dev/null, once printing every line
+# to a line buffered file and keeping all of them, like console output does,
+# and once through a BufferedSink keeping none; returns the seconds taken
+def output_benchmark(count):
+    program = f"""
+func main() {{
+  i = 0;
+  while (i < {count}) {{ print("line ", i, " of the output"); i = i + 1; }}
+}}
+"""
+    with open(os.devnull, "w", buffering=1) as devnull:
+        interpreter = Interpreter(output_sink=ConsoleSink(devnull))
+        start = time.perf_counter()
+        interpreter.run(program)
+        console = time.perf_counter() - start
+    fd = os.open(os.devnull, os.O_WRONLY)
+    try:
+        interpreter = Interpreter(output_sink=BufferedSink(fd), max_output_log=0)
+        start = time.perf_counter()
+        interpreter.run(program)
+        buffered = time.perf_counter() - start
+    finally:
+        os.close(fd)
+    return console, buffered
+
+
+# runs a program summing count lines of input, read from a list, a file
+# descriptor and a mapped file; returns the seconds taken by each
+def input_benchmark(count):
+    program = f"""
+func main() {{
+  i = 0;
+  total = 0;
+  while (i < {count}) {{ total = total + inputi(); i = i + 1; }}
+  print(total);
+}}
+"""
+    lines = [str(i) for i in range(count)]
+    fd, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        times = []
+        for make_source in (
+            lambda: lines,
+            lambda: FileSource(os.open(path, os.O_RDONLY)),
+            lambda: MappedFileSource(path),
+        ):
+            source = make_source()
+            interpreter = Interpreter(console_output=False, inp=source)
+            start = time.perf_counter()
+            interpreter.run(program)
+            times.append(time.perf_counter() - start)
+            if isinstance(source, FileSource):
+                os.close(source.fd)
+        return times
+    finally:
+        os.unlink(path)
+
+
+# parses a program with count statements, then reads it back from a
+# ParseCache repeat times; returns the seconds taken by the parse and the
+# best read
+def parse_benchmark(count, repeat):
+    statements = "\n".join(f"  x{i} = x{i - 1} + {i} * 2;" for i in range(1, count))
+    program = f"func main() {{\n  x0 = 0;\n{statements}\n  print(x0);\n}}"
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ParseCache(directory)
+        start = time.perf_counter()
+        cache.parse(program)
+        parsed = time.perf_counter() - start
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cache.parse(program)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+    return parsed, best
+
+
+# times parsing a program made of count random functions with each parser
+# (tests/test_parsers.py checks that they build the same trees), and returns
+# its size in bytes and the best seconds taken by the scanner alone, yacc's
+# parser and the descent parser
+def parser_benchmark(count, repeat, seed=0):
+    rng = random.Random(seed)
+    functions = [" ".join(random_function(rng)) for _ in range(count)]
+    program = "\n".join(functions)
+    best = {}
+    for name, parse in (
+        ("scan", lambda: scan(program)),
+        ("lalr", lambda: parse_program(program, "lalr")),
+        ("descent", lambda: parse_program(program, "descent")),
+    ):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parse()
+            elapsed = time.perf_counter() - start
+            if name not in best or elapsed < best[name]:
+                best[name] = elapsed
+    return len(program), best["scan"], best["lalr"], best["descent"]
+
+
+# times scanning count random functions, separated by comments and white
+# space, with ply's lexer and with brewscan (tests/test_scanner.py checks
+# that they find the same tokens), and returns the size in bytes of the
+# program, its number of tokens and the best seconds taken by each
+def scan_benchmark(count, repeat, seed=0):
+    program = random_source(random.Random(seed), count)
+    lexer = build_lexer()
+    tokens = len(scan(program))
+    best = {}
+    for name, scanner in (("ply", lambda: list(iter(lexer.token, None))), ("scan", lambda: scan(program))):
+        for _ in range(repeat):
+            lexer.input(program)
+            start = time.perf_counter()
+            scanner()
+            elapsed = time.perf_counter() - start
+            if name not in best or elapsed < best[name]:
+                best[name] = elapsed
+    return len(program), tokens, best["ply"], best["scan"]
+
+
+STARTUP = """
+import time
+start = time.perf_counter()
+import brewparse
+imported = time.perf_counter()
+brewparse.parse_program("func main() { print(1 + 2); }")
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+# imports brewparse and parses a first program in a new python process
+# repeat times; returns the seconds taken by the fastest import and the
+# fastest first parse
+def startup_benchmark(repeat):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    imports = []
+    parses = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", STARTUP], cwd=directory, capture_output=True, text=True, check=True
+        )
+        imported, parsed = result.stdout.split()
+        imports.append(float(imported))
+        parses.append(float(parsed))
+    return min(imports), min(parses)
+
+
+def count_nodes(node):
+    total = 1
+    for _, value in node.items():
+        if isinstance(value, Element):
+            total += count_nodes(value)
+        elif isinstance(value, list):
+            total += sum(count_nodes(item) for item in value if isinstance(item, Element))
+    return total
+
+
+# python bench_v4.py [--engine tree] [--environment shallow] [--unboxed] [--repeat 3] [benchmark ...]
+# python bench_v4.py --objects 1000000
+# python bench_v4.py --memory 100000
+# python bench_v4.py --output 100000
+# python bench_v4.py --input 100000
+# python bench_v4.py --parse 10000
+# python bench_v4.py --startup
+# python bench_v4.py --parsers 20000
+# python bench_v4.py --scan 20000
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("names", nargs="*", default=list(BENCHMARKS))
+    parser.add_argument("--engine", default="tree", choices=sorted(Interpreter.ENGINES))
+    parser.add_argument("--environment", default="shallow", choices=sorted(Interpreter.ENVIRONMENTS))
+    parser.add_argument("--unboxed", action="store_true", help="tree engine with unboxed values")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--objects", type=int, help="benchmark the object model with this many objects")
+    parser.add_argument("--memory", type=int, help="measure the size of this many values and objects")
+    parser.add_argument("--output", type=int, help="benchmark printing this many lines")
+    parser.add_argument("--input", type=int, help="benchmark reading this many lines")
+    parser.add_argument("--parse", type=int, help="benchmark the parse cache on this many statements")
+    parser.add_argument("--startup", action="store_true", help="time importing the parser and a first parse")
+    parser.add_argument("--parsers", type=int, help="time the parsers on this many random functions")
+    parser.add_argument("--scan", type=int, help="time the scanners on this many random functions")
+    args = parser.parse_args()
+    if args.scan:
+        size, tokens, ply, scanned = scan_benchmark(args.scan, args.repeat)
+        print(
+            f"{size / (1 << 20):.1f} MB {tokens} tokens  "
+            f"ply {ply * 1000:9.1f} ms {tokens / ply / 1e6:6.2f} M tokens/s  "
+            f"scan {scanned * 1000:9.1f} ms {tokens / scanned / 1e6:6.2f} M tokens/s"
+        )
+        return
+    if args.parsers:
+        size, scanned, lalr, descent = parser_benchmark(args.parsers, args.repeat)
+        megabytes = size / (1 << 20)
+        print(
+            f"{megabytes:.1f} MB  scan {scanned * 1000:9.1f} ms  "
+            f"lalr {lalr * 1000:9.1f} ms {megabytes / lalr:6.2f} MB/s  "
+            f"descent {descent * 1000:9.1f} ms {megabytes / descent:6.2f} MB/s"
+        )
+        return
+    if args.startup:
+        imported, parsed = startup_benchmark(args.repeat)
+        print(f"import {imported * 1000:9.1f} ms  first parse {parsed * 1000:9.1f} ms")
+        return
+    if args.parse:
+        parsed, cached = parse_benchmark(args.parse, args.repeat)
+        print(f"parse {parsed * 1000:9.1f} ms  cached {cached * 1000:9.1f} ms")
+        return
+    if args.input:
+        listed, file, mapped = input_benchmark(args.input)
+        print(f"list {listed * 1000:9.1f} ms  file {file * 1000:9.1f} ms  mapped {mapped * 1000:9.1f} ms")
+        return
+    if args.output:
+        console, buffered = output_benchmark(args.output)
+        print(f"console {console * 1000:9.1f} ms  buffered {buffered * 1000:9.1f} ms")
+        return
+    if args.memory:
+        value_size, object_size, node_size = memory_benchmark(args.memory)
+        print(f"{value_size:7.1f} bytes/value {object_size:7.1f} bytes/object {node_size:7.1f} bytes/ast node")
+        return
+    if args.objects:
+        build, read, size = object_model_benchmark(args.objects)
+        print(f"build {build * 1000:9.1f} ms  read {read * 1000:9.1f} ms  {size:7.1f} bytes/object")
+        return
+    sys.setrecursionlimit(20000)
+    for name in args.names:
+        best, ops = run_benchmark(name, args.engine, args.repeat, args.environment, args.unboxed)
+        print(f"{name:<16s} {best * 1000:9.1f} ms {best * 1e6 / ops:9.2f} us/op")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import gc
+
+from brewparse import precedence
+from element import Element
+from intbase import InterpreterBase
+
+# A recursive descent parser for the grammar in brewparse.py, which builds
+# the same trees as the one generated from it by yacc without calling a
+# function per grammar rule. Binary operators are parsed by precedence
+# climbing, using the levels and associativity of brewparse.precedence.
+# Unlike yacc's parser, it stops at the first syntax error, so a program
+# yacc recovers from (after reporting the error) is rejected here; and as
+# it recurses once per nested expression or block, it's limited by python's
+# recursion limit rather than by memory.
+
+END = "$end"
+
+BINARY_LEVELS = {}  # token type -> (precedence level, level of its right operand)
+UNARY_LEVEL = None
+for level, (associativity, *types) in enumerate(precedence, 1):
+    for token_type in types:
+        if token_type in ("UMINUS", "NOT"):
+            UNARY_LEVEL = level
+        else:
+            BINARY_LEVELS[token_type] = (level, level + 1 if associativity == "left" else level)
+
+# tokens that can't start a statement other than an expression
+STATEMENT_KEYWORDS = {"IF", "WHILE", "RETURN"}
+
+
+class DescentParser:
+    # tokens is a list of tokens as brewscan.scan gives them
+    def __init__(self, tokens):
+        self.types = [token[0] for token in tokens]
+        self.values = [token[1] for token in tokens]
+        # enough to look past the end of the longest lookahead
+        self.types += [END] * 4
+        self.values += [None] * 4
+        self.pos = 0
+
+    # the tree has no cycles, so the collector only slows building it down
+    def parse_program(self):
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self.__program()
+        finally:
+            if enabled:
+                gc.enable()
+
+    def __program(self):
+        functions = [self.__func()]
+        while self.types[self.pos] == "FUNC":
+            functions.append(self.__func())
+        if self.types[self.pos] != END:
+            self.__error()
+        return Element(InterpreterBase.PROGRAM_DEF, functions=functions)
+
+    # reports a syntax error at the current token the way brewparse.p_error
+    # does and gives up
+    def __error(self):
+        if self.types[self.pos] == END:
+            print("Syntax error at EOF")
+        else:
+            print(f"Syntax error at '{self.values[self.pos]}'")
+        raise SyntaxError("Syntax error")
+
+    def __expect(self, token_type):
+        if self.types[self.pos] != token_type:
+            self.__error()
+        value = self.values[self.pos]
+        self.pos += 1
+        return value
+
+    def __func(self):
+        self.__expect("FUNC")
+        name = self.__expect("NAME")
+        args = self.__formal_args()
+        statements = self.__block()
+        return Element(InterpreterBase.FUNC_DEF, name=name, args=args, statements=statements)
+
+    def __lambda(self):
+        self.pos += 1  # LAMBDA
+        args = self.__formal_args()
+        statements = self.__block()
+        return Element(InterpreterBase.LAMBDA_DEF, args=args, statements=statements)
+
+    # ( [formal_arg {, formal_arg}] )
+    def __formal_args(self):
+        self.__expect("LPAREN")
+        args = []
+        if self.types[self.pos] == "RPAREN":
+            self.pos += 1
+            return args
+        while True:
+            if self.types[self.pos] == "REF":
+                self.pos += 1
+                args.append(Element(InterpreterBase.REFARG_DEF, name=self.__expect("NAME")))
+            else:
+                args.append(Element(InterpreterBase.ARG_DEF, name=self.__expect("NAME")))
+            if self.types[self.pos] != "COMMA":
+                break
+            self.pos += 1
+        self.__expect("RPAREN")
+        return args
+
+    # { statement {statement} }
+    def __block(self):
+        self.__expect("LBRACE")
+        statements = [self.__statement()]
+        types = self.types
+        while types[self.pos] != "RBRACE":
+            statements.append(self.__statement())
+        self.pos += 1
+        return statements
+
+    def __statement(self):
+        types = self.types
+        pos = self.pos
+        token_type = types[pos]
+        if token_type == "NAME":
+            if types[pos + 1] == "ASSIGN":
+                name = self.values[pos]
+                self.pos = pos + 2
+                return self.__assignment(name)
+            if types[pos + 1] == "DOT" and types[pos + 2] == "NAME" and types[pos + 3] == "ASSIGN":
+                name = self.values[pos] + "." + self.values[pos + 2]
+                self.pos = pos + 4
+                return self.__assignment(name)
+        elif token_type in STATEMENT_KEYWORDS:
+            if token_type == "IF":
+                return self.__if()
+            if token_type == "WHILE":
+                return self.__while()
+            return self.__return()
+        expression = self.__expression(1)
+        self.__expect("SEMI")
+        return expression
+
+    def __assignment(self, name):
+        expression = self.__expression(1)
+        self.__expect("SEMI")
+        return Element("=", name=name, expression=expression)
+
+    def __if(self):
+        self.pos += 1  # IF
+        condition = self.__condition()
+        statements = self.__block()
+        else_statements = None
+        if self.types[self.pos] == "ELSE":
+            self.pos += 1
+            else_statements = self.__block()
+        return Element(
+            InterpreterBase.IF_DEF,
+            condition=condition,
+            statements=statements,
+            else_statements=else_statements,
+        )
+
+    def __while(self):
+        self.pos += 1  # WHILE
+        condition = self.__condition()
+        statements = self.__block()
+        return Element(InterpreterBase.WHILE_DEF, condition=condition, statements=statements)
+
+    # ( expression )
+    def __condition(self):
+        self.__expect("LPAREN")
+        condition = self.__expression(1)
+        self.__expect("RPAREN")
+        return condition
+
+    def __return(self):
+        self.pos += 1  # RETURN
+        expression = None
+        if self.types[self.pos] != "SEMI":
+            expression = self.__expression(1)
+        self.__expect("SEMI")
+        return Element(InterpreterBase.RETURN_DEF, expression=expression)
+
+    # an expression whose binary operators all have at least the precedence
+    # level min_level
+    def __expression(self, min_level):
+        types = self.types
+        token_type = types[self.pos]
+        if token_type == "NOT":
+            self.pos += 1
+            left = Element(InterpreterBase.NOT_DEF, op1=self.__expression(UNARY_LEVEL))
+        elif token_type == "MINUS":
+            self.pos += 1
+            left = Element(InterpreterBase.NEG_DEF, op1=self.__expression(UNARY_LEVEL))
+        else:
+            left = self.__primary()
+        while True:
+            levels = BINARY_LEVELS.get(types[self.pos])
+            if levels is None or levels[0] < min_level:
+                return left
+            op = self.values[self.pos]
+            self.pos += 1
+            left = Element(op, op1=left, op2=self.__expression(levels[1]))
+
+    def __primary(self):
+        pos = self.pos
+        token_type = self.types[pos]
+        value = self.values[pos]
+        self.pos = pos + 1
+        if token_type == "NAME":
+            return self.__name(value)
+        if token_type == "NUMBER":
+            return Element(InterpreterBase.INT_DEF, val=value)
+        if token_type == "STRING":
+            return Element(InterpreterBase.STRING_DEF, val=value)
+        if token_type == "LPAREN":
+            expression = self.__expression(1)
+            self.__expect("RPAREN")
+            return expression
+        if token_type == "TRUE" or token_type == "FALSE":
+            return Element(InterpreterBase.BOOL_DEF, val=value == InterpreterBase.TRUE_DEF)
+        if token_type == "NIL":
+            return Element(InterpreterBase.NIL_DEF)
+        if token_type == "AT":
+            return Element(InterpreterBase.OBJ_DEF)
+        if token_type == "LAMBDA":
+            self.pos = pos
+            return self.__lambda()
+        self.pos = pos
+        self.__error()
+
+    # a variable, field, function call or method call starting with name
+    def __name(self, name):
+        types = self.types
+        pos = self.pos
+        if types[pos] == "LPAREN":
+            self.pos = pos + 1
+            return Element(InterpreterBase.FCALL_DEF, name=name, args=self.__args())
+        if types[pos] == "DOT" and types[pos + 1] == "NAME":
+            field = self.values[pos + 1]
+            if types[pos + 2] == "LPAREN":
+                self.pos = pos + 3
+                return Element(InterpreterBase.MCALL_DEF, objref=name, name=field, args=self.__args())
+            self.pos = pos + 2
+            return Element(InterpreterBase.VAR_DEF, name=name + "." + field)
+        if types[pos] == "DOT":
+            self.pos = pos + 1
+            self.__error()
+        return Element(InterpreterBase.VAR_DEF, name=name)
+
+    # [expression {, expression}] ), after the (
+    def __args(self):
+        args = []
+        if self.types[self.pos] == "RPAREN":
+            self.pos += 1
+            return args
+        args.append(self.__expression(1))
+        while self.types[self.pos] == "COMMA":
+            self.pos += 1
+            args.append(self.__expression(1))
+        self.__expect("RPAREN")
+        return args
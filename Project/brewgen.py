@@ -0,0 +1,80 @@
+# Random programs using every rule of the grammar, as lists of tokens, for
+# checking that the parsers build the same trees (see tests/test_parsers.py)
+# and timing them (see bench_v4.py)
+NAMES = ["a", "b", "x1", "_y", "obj", "True", "fun"]
+BINARY_OPS = ["+", "-", "*", "/", "==", "!=", ">", ">=", "<", "<=", "&&", "||"]
+LITERALS = ["0", "42", '"text"', '""', '"a b"', "true", "false", "nil", "@"]
+
+
+def random_expression(rng, depth):
+    kind = rng.randrange(10 if depth > 0 else 3)
+    if kind == 0:
+        return [rng.choice(LITERALS)]
+    if kind == 1:
+        return [rng.choice(NAMES)]
+    if kind == 2:
+        return [rng.choice(NAMES), ".", rng.choice(NAMES)]
+    if kind in (3, 4, 5):
+        return random_expression(rng, depth - 1) + [rng.choice(BINARY_OPS)] + random_expression(rng, depth - 1)
+    if kind == 6:
+        return [rng.choice("-!")] + random_expression(rng, depth - 1)
+    if kind == 7:
+        return ["("] + random_expression(rng, depth - 1) + [")"]
+    if kind == 8:
+        callee = [rng.choice(NAMES)] if rng.random() < 0.5 else [rng.choice(NAMES), ".", rng.choice(NAMES)]
+        args = []
+        for i in range(rng.randrange(4)):
+            args += ([","] if i else []) + random_expression(rng, depth - 1)
+        return callee + ["("] + args + [")"]
+    return ["lambda"] + random_formal_args(rng) + random_block(rng, depth - 1)
+
+
+def random_formal_args(rng):
+    args = []
+    for i in range(rng.randrange(4)):
+        args += ([","] if i else []) + (["ref"] if rng.random() < 0.3 else []) + [rng.choice(NAMES)]
+    return ["("] + args + [")"]
+
+
+def random_block(rng, depth):
+    statements = []
+    for _ in range(rng.randrange(1, 4)):
+        statements += random_statement(rng, depth)
+    return ["{"] + statements + ["}"]
+
+
+def random_statement(rng, depth):
+    kind = rng.randrange(7 if depth > 0 else 4)
+    if kind == 0:
+        return [rng.choice(NAMES), "="] + random_expression(rng, depth) + [";"]
+    if kind == 1:
+        return [rng.choice(NAMES), ".", rng.choice(NAMES), "="] + random_expression(rng, depth) + [";"]
+    if kind == 2:
+        return random_expression(rng, depth) + [";"]
+    if kind == 3:
+        return ["return"] + (random_expression(rng, depth) if rng.random() < 0.7 else []) + [";"]
+    condition = ["("] + random_expression(rng, depth - 1) + [")"]
+    if kind == 4:
+        return ["while"] + condition + random_block(rng, depth - 1)
+    statement = ["if"] + condition + random_block(rng, depth - 1)
+    if kind == 5:
+        statement += ["else"] + random_block(rng, depth - 1)
+    return statement
+
+
+def random_function(rng, depth=3):
+    return ["func", rng.choice(NAMES)] + random_formal_args(rng) + random_block(rng, depth)
+
+
+SEPARATORS = [" ", " ", " ", "\t", "\n", "\n\n  ", " /* comment */ ", "/* a\n comment\n */"]
+
+
+# the tokens of count random functions, each followed by white space or a
+# comment, for checking and timing the scanner
+def random_source(rng, count):
+    pieces = []
+    for _ in range(count):
+        for token in random_function(rng):
+            pieces.append(token)
+            pieces.append(rng.choice(SEPARATORS))
+    return "".join(pieces)
@@ -1,4 +1,5 @@
-from ply import lex
+import os
+import sys
 
 reserved = (
     "FUNC",
@@ -126,5 +127,37 @@ def t_error(t):
     t.lexer.skip(1)
 
 
-# Build the lexer
-lex.lex()
+# Programs are split into these tokens by brewscan.scan; ply's lexer for
+# them, which it's checked against (see tests/test_scanner.py), is built by
+# build_lexer from the tables in lextab.py if brewlex.py hasn't changed
+# since they were generated (by running python brewparse.py), which skips
+# checking the rules above; otherwise from the rules, without writing any
+# tables.
+def lexer_signature():
+    import hashlib
+
+    with open(__file__, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def build_lexer():
+    from ply import lex
+
+    module = sys.modules[__name__]
+    try:
+        import lextab
+    except ImportError:
+        lextab = None
+    if getattr(lextab, "_lexsignature", None) == lexer_signature():
+        return lex.lex(module=module, optimize=True, lextab=lextab)
+    return lex.lex(module=module)
+
+
+# writes lextab.py to directory
+def write_lexer_tables(directory):
+    from ply import lex
+
+    lexer = lex.lex(module=sys.modules[__name__])
+    lexer.writetab("lextab", directory)
+    with open(os.path.join(directory, "lextab.py"), "a") as file:
+        file.write(f"_lexsignature = {lexer_signature()!r}\n")
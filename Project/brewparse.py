@@ -1,7 +1,10 @@
+import os
+import sys
+
 from element import Element
 from brewlex import *
+from brewscan import ScanLexer, scan
 from intbase import InterpreterBase
-from ply import yacc
 
 # Parsing rules
 
@@ -234,12 +237,50 @@ def p_error(p):
 
 
 # exported function
-def parse_program(program):
-    ast = yacc.parse(program)
+# Programs are split into tokens by brewscan.scan, which finds the tokens
+# the rules in brewlex.py define without ply's lexer. Nothing is built until
+# the first program is parsed with yacc's parser, so importing this module
+# doesn't import ply. The parser is then read from parsetab.py unless the
+# grammar above has changed since it was generated, in which case it's
+# generated again in memory. Run python brewparse.py to write the tables
+# again after changing it or the rules (see build_lexer).
+# parse_program's parser selects between that parser, "lalr", and the
+# recursive descent parser in brewdescent.py, "descent", which builds the
+# same trees faster from the same tokens.
+PARSERS = {"lalr", "descent"}
+
+lalr_parser = None
+
+
+def build_parser():
+    from ply import yacc
+
+    global lalr_parser
+    lalr_parser = yacc.yacc(module=sys.modules[__name__], debug=False, write_tables=False)
+
+
+def parse_program(program, parser="lalr"):
+    if parser == "descent":
+        from brewdescent import DescentParser
+
+        return DescentParser(scan(program)).parse_program()
+    if parser != "lalr":
+        raise ValueError(f"Unknown parser {parser}")
+    if lalr_parser is None:
+        build_parser()
+    ast = lalr_parser.parse(program, lexer=ScanLexer())
     if ast is None:
         raise SyntaxError("Syntax error")
     return ast
 
 
-# generate our parser
-yacc.yacc()
+def write_parser_tables():
+    from ply import yacc
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    write_lexer_tables(directory)
+    yacc.yacc(module=sys.modules[__name__], outputdir=directory)
+
+
+if __name__ == "__main__":
+    write_parser_tables()
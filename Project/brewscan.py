@@ -0,0 +1,128 @@
+import re
+
+import brewlex
+
+# A scanner for the tokens brewlex.py defines for ply's lexer, which finds
+# them all in one pass of a single regular expression instead of trying
+# each rule in turn, and gives them as (type, value, line, column) tuples,
+# with lines and columns counted from 1. It splits a program into the same
+# tokens ply's lexer does: patterns are tried in the same order, the rules
+# with actions first and then the operators longest first, and characters
+# no rule matches are reported as illegal and skipped, or made into a
+# token by themselves if they're a literal. Each program is scanned on its
+# own, so lines are counted from the start of each.
+
+# the rules with actions, with comments and strings matched without
+# backtracking (the comment pattern is only given up on once, see scan)
+ACTION_PATTERNS = [
+    ("NUMBER", brewlex.t_NUMBER.__doc__),
+    ("NAME", brewlex.t_NAME.__doc__),
+    ("newline", r"\n+"),
+    ("comment", r"/\*(?s:.*?)\*/"),
+    ("STRING", r'"[^"\n]*"'),
+]
+
+# the operators sorted the way ply does: by name, then longest pattern first
+OPERATOR_PATTERNS = sorted(
+    (name[2:], pattern)
+    for name, pattern in vars(brewlex).items()
+    if name.startswith("t_") and isinstance(pattern, str) and name != "t_ignore"
+)
+OPERATOR_PATTERNS.sort(key=lambda rule: len(rule[1]), reverse=True)
+
+# white space is skipped, and any other character but a newline is matched
+# by "other", so each match starts where the one before it ended
+IGNORE_PATTERN = ("ignore", f"[{re.escape(brewlex.t_ignore)}]+")
+OTHER_PATTERN = ("other", ".")
+
+
+# Each pattern is followed by an empty group named after it, which tells
+# the match's lastgroup which one matched; wrapping the patterns in the
+# groups instead would hide their first characters from re, which then
+# couldn't skip the ones that can't match without trying them.
+def compile_patterns(patterns):
+    return re.compile("|".join(f"{pattern}(?P<{name}>)" for name, pattern in patterns))
+
+
+# white space can't start any other token, so it's tried first
+TOKEN_PATTERN = compile_patterns([IGNORE_PATTERN] + ACTION_PATTERNS + OPERATOR_PATTERNS + [OTHER_PATTERN])
+# for the rest of a program once a comment is left open
+UNCOMMENTED_PATTERN = compile_patterns(
+    [IGNORE_PATTERN]
+    + [rule for rule in ACTION_PATTERNS if rule[0] != "comment"]
+    + OPERATOR_PATTERNS
+    + [OTHER_PATTERN]
+)
+
+OPERATOR_TYPES = {name for name, _ in OPERATOR_PATTERNS}
+
+
+def scan(program):
+    tokens = []
+    append = tokens.append
+    reserved_map = brewlex.reserved_map
+    operator_types = OPERATOR_TYPES
+    line = 1
+    line_start = 0  # where line starts in program
+    pattern = TOKEN_PATTERN
+    pos = 0
+    while pos is not None:
+        matches = pattern.finditer(program, pos)
+        pos = None
+        for match in matches:
+            kind = match.lastgroup
+            if kind == "ignore":
+                continue
+            start = match.start()
+            if kind == "NAME":
+                value = match.group()
+                append((reserved_map.get(value, "NAME"), value, line, start - line_start + 1))
+            elif kind in operator_types:
+                append((kind, match.group(), line, start - line_start + 1))
+                # a / followed by * that didn't start a comment means no
+                # comment is closed after it, so comments are no longer
+                # looked for rather than searched to the end every time
+                if kind == "DIVIDE" and pattern is TOKEN_PATTERN and program.startswith("*", start + 1):
+                    pattern = UNCOMMENTED_PATTERN
+                    pos = start + 1
+                    break
+            elif kind == "NUMBER":
+                append(("NUMBER", int(match.group()), line, start - line_start + 1))
+            elif kind == "newline":
+                line += match.end() - start
+                line_start = match.end()
+            elif kind == "STRING":
+                append(("STRING", match.group()[1:-1], line, start - line_start + 1))
+            elif kind == "comment":
+                text = match.group()
+                newlines = text.count("\n")
+                if newlines:
+                    line += newlines
+                    line_start = start + text.rfind("\n") + 1
+            else:
+                char = match.group()
+                if char in brewlex.literals:
+                    append((char, char, line, start - line_start + 1))
+                else:
+                    print(f"Illegal character {char}")
+    return tokens
+
+
+# the token objects yacc's parser takes
+class LexToken:
+    __slots__ = ("type", "value", "lineno", "column", "lexer")
+
+    def __init__(self, token):
+        self.type, self.value, self.lineno, self.column = token
+
+
+# a lexer for yacc's parser that gives it the tokens scan finds
+class ScanLexer:
+    def input(self, program):
+        self.tokens = iter(scan(program))
+
+    def token(self):
+        token = next(self.tokens, None)
+        if token is None:
+            return None
+        return LexToken(token)
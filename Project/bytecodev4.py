@@ -0,0 +1,331 @@
+import sys
+
+from intbase import InterpreterBase
+from optimizerv4 import may_create_variable
+from type_valuev4 import CallSite, FieldCache, Type, literal_value
+
+# Every instruction is two ints in CodeObject.code: the opcode and a single
+# operand (0 when unused). Operands are either indexes into the code object's
+# constant pool, jump targets, or small counts.
+LOAD_NAME = 0  # push variable consts[arg]
+LOAD_FIELD = 1  # push field consts[arg] = (var, FieldCache) of an object variable
+PUSH_CONST = 2  # push the literal Value consts[arg]
+PUSH_NIL = 3
+STORE = 4  # pop and assign to consts[arg] = (var, field or None)
+BINARY_OP = 5  # pop two operands, push the result of operator consts[arg]
+UNARY_NEG = 6
+UNARY_NOT = 7
+IF_FALSE = 8  # pop an if condition, jump to arg when it is false
+WHILE_FALSE = 9  # pop a while condition, jump to arg when it is false
+JUMP = 10
+PUSH_SCOPE = 11
+POP_SCOPE = 12
+RESOLVE_FUNC = 13  # push a pending call to consts[arg] = CallSite
+RESOLVE_METHOD = 14  # push a pending method call to consts[arg] = CallSite
+BIND_ARG = 15  # pop an argument into parameter arg of the pending call
+CALL = 16  # pop the pending call, run it and push its return value
+PRINT_BEGIN = 17
+PRINT_ARG = 18
+PRINT_END = 19
+INPUTI = 20  # arg is the number of arguments (only a single one is evaluated)
+MAKE_CLOSURE = 21  # push a closure over the lambda ast consts[arg]
+MAKE_OBJECT = 22
+POP = 23
+RETURN = 24  # pop the return value, then leave arg block scopes
+RETURN_NIL = 25  # leave arg block scopes and return nil
+TRACE = 26  # print statement consts[arg] (only emitted with trace_output)
+BIND_VAR = 27  # bind consts[arg] = (param index, var, field or None) to the pending call
+LOAD_PROTO = 28  # push the prototype of object variable consts[arg]
+INPUTS = 29  # inputs(), like INPUTI
+
+OPCODES = (
+    "LOAD_NAME",
+    "LOAD_FIELD",
+    "PUSH_CONST",
+    "PUSH_NIL",
+    "STORE",
+    "BINARY_OP",
+    "UNARY_NEG",
+    "UNARY_NOT",
+    "IF_FALSE",
+    "WHILE_FALSE",
+    "JUMP",
+    "PUSH_SCOPE",
+    "POP_SCOPE",
+    "RESOLVE_FUNC",
+    "RESOLVE_METHOD",
+    "BIND_ARG",
+    "CALL",
+    "PRINT_BEGIN",
+    "PRINT_ARG",
+    "PRINT_END",
+    "INPUTI",
+    "MAKE_CLOSURE",
+    "MAKE_OBJECT",
+    "POP",
+    "RETURN",
+    "RETURN_NIL",
+    "TRACE",
+    "BIND_VAR",
+    "LOAD_PROTO",
+    "INPUTS",
+)
+
+# opcodes whose operand is an index into the constant pool
+CONST_OPCODES = {
+    LOAD_NAME,
+    LOAD_FIELD,
+    PUSH_CONST,
+    STORE,
+    BINARY_OP,
+    RESOLVE_FUNC,
+    RESOLVE_METHOD,
+    MAKE_CLOSURE,
+    TRACE,
+    BIND_VAR,
+    LOAD_PROTO,
+}
+
+
+# The compiled form of one function or lambda body
+class CodeObject:
+    def __init__(self, name, params):
+        self.name = name
+        self.params = params  # (name, passed by reference) per formal param
+        self.code = []
+        self.consts = []
+        self.const_index = {}
+
+    def add_const(self, const):
+        if const not in self.const_index:
+            self.const_index[const] = len(self.consts)
+            self.consts.append(const)
+        return self.const_index[const]
+
+
+# Lowers the ast of one function or lambda into a CodeObject
+class Compiler:
+    def __init__(self, trace_output=False):
+        self.trace_output = trace_output
+
+    def compile_function(self, func_ast):
+        params = tuple(
+            (
+                formal_ast.get("name"),
+                formal_ast.elem_type == InterpreterBase.REFARG_DEF
+                or formal_ast.elem_type == InterpreterBase.OBJ_DEF,
+            )
+            for formal_ast in func_ast.get("args")
+        )
+        name = func_ast.get("name")
+        if name is None:
+            name = InterpreterBase.LAMBDA_DEF
+        self.code_obj = CodeObject(name, params)
+        self.depth = 0  # number of block scopes open at the current point
+        self.__compile_block(func_ast.get("statements"))
+        self.__emit(RETURN_NIL)
+        return self.code_obj
+
+    def __emit(self, opcode, arg=0):
+        self.code_obj.code.append(opcode)
+        self.code_obj.code.append(arg)
+        return len(self.code_obj.code) - 1
+
+    def __emit_const(self, opcode, const):
+        return self.__emit(opcode, self.code_obj.add_const(const))
+
+    def __here(self):
+        return len(self.code_obj.code)
+
+    def __patch(self, operand_index, target):
+        self.code_obj.code[operand_index] = target
+
+    # blocks that can't create a variable get no scope of their own
+    def __compile_block(self, statements):
+        scoped = may_create_variable(statements)
+        if scoped:
+            self.__emit(PUSH_SCOPE)
+            self.depth += 1
+        for statement in statements:
+            if self.trace_output:
+                self.__emit_const(TRACE, statement)
+            self.__compile_statement(statement)
+        if scoped:
+            self.__emit(POP_SCOPE)
+            self.depth -= 1
+
+    # statements that the tree walker skips don't produce any code
+    def __compile_statement(self, statement):
+        kind = statement.elem_type
+        if kind == InterpreterBase.FCALL_DEF or kind == InterpreterBase.MCALL_DEF:
+            self.__compile_expr(statement)
+            self.__emit(POP)
+        elif kind == "=":
+            self.__compile_expr(statement.get("expression"))
+            self.__emit_const(STORE, self.__split_var_name(statement.get("name")))
+        elif kind == InterpreterBase.RETURN_DEF:
+            expr_ast = statement.get("expression")
+            if expr_ast is None:
+                self.__emit(RETURN_NIL, self.depth)
+            else:
+                self.__compile_expr(expr_ast)
+                self.__emit(RETURN, self.depth)
+        elif kind == InterpreterBase.IF_DEF:
+            self.__compile_if(statement)
+        elif kind == InterpreterBase.WHILE_DEF:
+            self.__compile_while(statement)
+
+    def __compile_if(self, if_ast):
+        self.__compile_expr(if_ast.get("condition"))
+        to_else = self.__emit(IF_FALSE)
+        self.__compile_block(if_ast.get("statements"))
+        else_statements = if_ast.get("else_statements")
+        if else_statements is None:
+            self.__patch(to_else, self.__here())
+            return
+        to_end = self.__emit(JUMP)
+        self.__patch(to_else, self.__here())
+        self.__compile_block(else_statements)
+        self.__patch(to_end, self.__here())
+
+    def __compile_while(self, while_ast):
+        top = self.__here()
+        self.__compile_expr(while_ast.get("condition"))
+        to_end = self.__emit(WHILE_FALSE)
+        self.__compile_block(while_ast.get("statements"))
+        self.__emit(JUMP, top)
+        self.__patch(to_end, self.__here())
+
+    def __compile_expr(self, expr_ast):
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.NIL_DEF:
+            self.__emit(PUSH_NIL)
+        elif kind == InterpreterBase.INT_DEF:
+            self.__emit_const(PUSH_CONST, literal_value(Type.INT, expr_ast.get("val")))
+        elif kind == InterpreterBase.STRING_DEF:
+            self.__emit_const(PUSH_CONST, literal_value(Type.STRING, expr_ast.get("val")))
+        elif kind == InterpreterBase.BOOL_DEF:
+            self.__emit_const(PUSH_CONST, literal_value(Type.BOOL, expr_ast.get("val")))
+        elif kind == InterpreterBase.VAR_DEF:
+            var_name, object_var_name = self.__split_var_name(expr_ast.get("name"))
+            if object_var_name is None:
+                self.__emit_const(LOAD_NAME, var_name)
+            elif object_var_name == "proto":
+                self.__emit_const(LOAD_PROTO, var_name)
+            else:
+                self.__emit_const(LOAD_FIELD, (var_name, FieldCache(object_var_name)))
+        elif kind == InterpreterBase.MCALL_DEF:
+            args = expr_ast.get("args")
+            self.__emit_const(
+                RESOLVE_METHOD, CallSite(expr_ast.get("name"), len(args), expr_ast.get("objref"))
+            )
+            self.__compile_args(args)
+            self.__emit(CALL)
+        elif kind == InterpreterBase.FCALL_DEF:
+            self.__compile_fcall(expr_ast)
+        elif kind == InterpreterBase.NEG_DEF:
+            self.__compile_expr(expr_ast.get("op1"))
+            self.__emit(UNARY_NEG)
+        elif kind == InterpreterBase.NOT_DEF:
+            self.__compile_expr(expr_ast.get("op1"))
+            self.__emit(UNARY_NOT)
+        elif kind == InterpreterBase.LAMBDA_DEF:
+            self.__emit_const(MAKE_CLOSURE, expr_ast)
+        elif kind == InterpreterBase.OBJ_DEF:
+            self.__emit(MAKE_OBJECT)
+        else:
+            self.__compile_expr(expr_ast.get("op1"))
+            self.__compile_expr(expr_ast.get("op2"))
+            self.__emit_const(BINARY_OP, kind)
+
+    def __compile_fcall(self, call_ast):
+        func_name = call_ast.get("name")
+        args = call_ast.get("args")
+        if func_name == "print":
+            self.__emit(PRINT_BEGIN)
+            for arg in args:
+                self.__compile_expr(arg)
+                self.__emit(PRINT_ARG)
+            self.__emit(PRINT_END)
+        elif func_name == "inputi" or func_name == "inputs":
+            # the prompt is only evaluated when it is the single argument
+            if len(args) == 1:
+                self.__compile_expr(args[0])
+            self.__emit(INPUTI if func_name == "inputi" else INPUTS, len(args))
+        else:
+            self.__emit_const(RESOLVE_FUNC, CallSite(func_name, len(args)))
+            self.__compile_args(args)
+            self.__emit(CALL)
+
+    # variables are bound with BIND_VAR, which can pass their Cell to a ref
+    # parameter
+    def __compile_args(self, args):
+        for index, arg in enumerate(args):
+            if arg.elem_type == InterpreterBase.VAR_DEF:
+                self.__emit_const(BIND_VAR, (index,) + self.__split_var_name(arg.get("name")))
+                continue
+            self.__compile_expr(arg)
+            self.__emit(BIND_ARG, index)
+
+    def __split_var_name(self, var_name):
+        parts = var_name.split(".")
+        if len(parts) == 2:
+            return parts[0], parts[1]
+        return parts[0], None
+
+
+def describe_params(params):
+    return ", ".join(("ref " if by_ref else "") + name for name, by_ref in params)
+
+
+def disassemble(code_obj):
+    lines = [f"code for {code_obj.name}({describe_params(code_obj.params)}):"]
+    code = code_obj.code
+    for offset in range(0, len(code), 2):
+        opcode, arg = code[offset], code[offset + 1]
+        line = f"{offset:6d} {OPCODES[opcode]:<15s}"
+        if opcode in CONST_OPCODES:
+            const = code_obj.consts[arg]
+            if opcode == TRACE:
+                const = str(const)
+            elif opcode == MAKE_CLOSURE:
+                const = f"lambda({', '.join(arg.get('name') for arg in const.get('args'))})"
+            elif opcode == PUSH_CONST:
+                const = const.v
+            elif opcode == LOAD_FIELD:
+                const = (const[0], const[1].symbol)
+            elif opcode == RESOLVE_FUNC:
+                const = (const.func_name, const.num_params)
+            elif opcode == RESOLVE_METHOD:
+                const = (const.mfunc_objref, const.func_name, const.num_params)
+            line += f"{arg:4d} ({const!r})"
+        elif arg or opcode in (JUMP, IF_FALSE, WHILE_FALSE, BIND_ARG):
+            line += f"{arg:4d}"
+        lines.append(line.rstrip())
+    return "\n".join(lines)
+
+
+# disassembles every function (and the lambdas inside them) of a program
+def disassemble_program(ast, trace_output=False):
+    compiler = Compiler(trace_output)
+    pending = list(ast.get("functions"))
+    listings = []
+    while pending:
+        code_obj = compiler.compile_function(pending.pop(0))
+        listings.append(disassemble(code_obj))
+        for opcode, arg in zip(code_obj.code[::2], code_obj.code[1::2]):
+            if opcode == MAKE_CLOSURE:
+                pending.append(code_obj.consts[arg])
+    return "\n\n".join(listings)
+
+
+# FOR DEBUGGING PURPOSES: python bytecodev4.py program.br
+def main():
+    from brewparse import parse_program
+
+    with open(sys.argv[1]) as source:
+        print(disassemble_program(parse_program(source.read())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,452 @@
+import operator
+
+from intbase import InterpreterBase, ErrorType
+from optimizerv4 import may_create_variable
+from type_valuev4 import (
+    CallSite,
+    Cell,
+    Object,
+    Closure,
+    FieldCache,
+    PYTHON_TYPES,
+    Type,
+    Value,
+    bool_value,
+    copy_value,
+    get_printable,
+    int_value,
+    literal_value,
+    printable_arg,
+)
+
+
+def string_value(v):
+    return Value(Type.STRING, v)
+
+
+# operators that can be applied directly to the python values when both
+# operands are ints, mapped to the function making the Value of their result
+INT_OPS = {
+    "+": (int_value, operator.add),
+    "-": (int_value, operator.sub),
+    "*": (int_value, operator.mul),
+    "/": (int_value, operator.floordiv),
+    "==": (bool_value, operator.eq),
+    "!=": (bool_value, operator.ne),
+    "<": (bool_value, operator.lt),
+    "<=": (bool_value, operator.le),
+    ">": (bool_value, operator.gt),
+    ">=": (bool_value, operator.ge),
+}
+
+# the same for every type whose operators can be applied directly when both
+# operands have that type; other operand types need the promotions done by
+# Interpreter.eval_bin_op. String + is left to eval_bin_op as well, as
+# appending to a rope (see RopeValue) mustn't join it first.
+SPECIALISED_OPS = {
+    Type.INT: INT_OPS,
+    Type.STRING: {
+        "==": (bool_value, operator.eq),
+        "!=": (bool_value, operator.ne),
+    },
+    Type.BOOL: {
+        "&&": (bool_value, lambda x, y: x and y),
+        "||": (bool_value, lambda x, y: x or y),
+        "==": (bool_value, operator.eq),
+        "!=": (bool_value, operator.ne),
+    },
+}
+GENERIC_OP = (None, None, None)
+
+
+# Specialises an operator node for the operands it is first executed with:
+# returns (operand type, result Value maker, python operator). Callers apply the
+# operator directly when both operands have the operand type and fall back to
+# eval_bin_op otherwise; GENERIC_OP's guard never passes.
+def quicken_op(operation, left_value_obj, right_value_obj):
+    if left_value_obj.t is right_value_obj.t:
+        specialised = SPECIALISED_OPS.get(left_value_obj.t, {}).get(operation)
+        if specialised is not None:
+            return (left_value_obj.t,) + specialised
+    return GENERIC_OP
+
+
+# SPECIALISED_OPS for the unboxed values of Interpreter(unboxed=True), keyed
+# by python type; the python operators already give unboxed results
+UNBOXED_OPS = {
+    python_type: {operation: f for operation, (_, f) in SPECIALISED_OPS[t].items()}
+    for python_type, t in PYTHON_TYPES.items()
+}
+GENERIC_UNBOXED_OP = (None, None)
+
+
+# quicken_op for unboxed operands: returns (python type, python operator)
+def quicken_unboxed_op(operation, left, right):
+    if left.__class__ is right.__class__:
+        f = UNBOXED_OPS.get(left.__class__, {}).get(operation)
+        if f is not None:
+            return (left.__class__, f)
+    return GENERIC_UNBOXED_OP
+
+
+# Compiles the ast of every function into nested python closures the first
+# time the function is called, so running a statement or evaluating an
+# expression no longer dispatches on elem_type. Compiled statements return
+# None to continue, or the Value being returned from the function.
+# Everything that isn't dispatch (name lookup, coercions, errors) is delegated
+# to the Interpreter, so the output matches the tree walker exactly.
+class ClosureCompiler:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.env = interpreter.env
+        self.nil_value = interpreter.NIL_VALUE
+        self.functions = {}  # func/lambda ast -> (params, compiled body)
+
+    def run(self, main_func):
+        _, body = self.__get_function(main_func.func_ast)
+        body()
+
+    def __get_function(self, func_ast):
+        function = self.functions.get(func_ast)
+        if function is None:
+            # (name, passed by reference) for each formal parameter
+            params = tuple(
+                (
+                    formal_ast.get("name"),
+                    formal_ast.elem_type == InterpreterBase.REFARG_DEF
+                    or formal_ast.elem_type == InterpreterBase.OBJ_DEF,
+                )
+                for formal_ast in func_ast.get("args")
+            )
+            # the body creates its variables in the scope of the parameters
+            function = (params, self.__compile_block(func_ast.get("statements"), False))
+            self.functions[func_ast] = function
+        return function
+
+    def __compile_block(self, statements, scoped=True):
+        compiled = []
+        for statement in statements:
+            run_statement = self.__compile_statement(statement)
+            if self.interpreter.trace_output:
+                run_statement = self.__trace(statement, run_statement)
+            if run_statement is not None:
+                compiled.append(run_statement)
+        compiled = tuple(compiled)
+        push = self.env.push
+        pop = self.env.pop
+
+        # blocks that can't create a variable run without a scope of their own
+        if not scoped or not may_create_variable(statements):
+
+            def run_unscoped_block():
+                for run_statement in compiled:
+                    return_val = run_statement()
+                    if return_val is not None:
+                        return return_val
+
+            return run_unscoped_block
+
+        def run_block():
+            push()
+            for run_statement in compiled:
+                return_val = run_statement()
+                if return_val is not None:
+                    pop()
+                    return return_val
+            pop()
+
+        return run_block
+
+    def __trace(self, statement, run_statement):
+        def run_traced():
+            print(statement)
+            if run_statement is not None:
+                return run_statement()
+
+        return run_traced
+
+    # returns None for statements that the tree walker skips
+    def __compile_statement(self, statement):
+        kind = statement.elem_type
+        if kind == InterpreterBase.FCALL_DEF or kind == InterpreterBase.MCALL_DEF:
+            call = self.__compile_expr(statement)
+
+            def run_call():
+                call()
+
+            return run_call
+        if kind == "=":
+            return self.__compile_assign(statement)
+        if kind == InterpreterBase.RETURN_DEF:
+            return self.__compile_return(statement)
+        if kind == InterpreterBase.IF_DEF:
+            return self.__compile_if(statement)
+        if kind == InterpreterBase.WHILE_DEF:
+            return self.__compile_while(statement)
+        return None
+
+    def __compile_assign(self, assign_ast):
+        var_name, object_var_name = self.interpreter.split_var_name(assign_ast.get("name"))
+        expr = self.__compile_expr(assign_ast.get("expression"))
+        assign_value = self.interpreter.assign_value
+
+        def run_assign():
+            assign_value(var_name, object_var_name, expr())
+
+        return run_assign
+
+    def __compile_return(self, return_ast):
+        expr_ast = return_ast.get("expression")
+        nil_value = self.nil_value
+        if expr_ast is None:
+            return lambda: nil_value
+        expr = self.__compile_expr(expr_ast)
+        return lambda: copy_value(expr())
+
+    def __compile_if(self, if_ast):
+        cond = self.__compile_expr(if_ast.get("condition"))
+        run_then = self.__compile_block(if_ast.get("statements"))
+        else_statements = if_ast.get("else_statements")
+        run_else = None
+        if else_statements is not None:
+            run_else = self.__compile_block(else_statements)
+        eval_condition = self.interpreter.eval_condition
+
+        def run_if():
+            result = cond()
+            if result.t is Type.BOOL:
+                taken = result.v
+            else:
+                taken = eval_condition(result, "if")
+            if taken:
+                return run_then()
+            if run_else is not None:
+                return run_else()
+
+        return run_if
+
+    def __compile_while(self, while_ast):
+        cond = self.__compile_expr(while_ast.get("condition"))
+        run_body = self.__compile_block(while_ast.get("statements"))
+        eval_condition = self.interpreter.eval_condition
+
+        def run_while():
+            while True:
+                result = cond()
+                if result.t is Type.BOOL:
+                    if not result.v:
+                        return None
+                elif not eval_condition(result, "while"):
+                    return None
+                return_val = run_body()
+                if return_val is not None:
+                    return return_val
+
+        return run_while
+
+    def __compile_expr(self, expr_ast):
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.NIL_DEF:
+            nil_value = self.nil_value
+            return lambda: nil_value
+        if kind == InterpreterBase.INT_DEF:
+            return self.__compile_literal(literal_value(Type.INT, expr_ast.get("val")))
+        if kind == InterpreterBase.STRING_DEF:
+            return self.__compile_literal(literal_value(Type.STRING, expr_ast.get("val")))
+        if kind == InterpreterBase.BOOL_DEF:
+            return self.__compile_literal(literal_value(Type.BOOL, expr_ast.get("val")))
+        if kind == InterpreterBase.VAR_DEF:
+            return self.__compile_name(expr_ast)
+        if kind == InterpreterBase.MCALL_DEF:
+            return self.__compile_mcall(expr_ast)
+        if kind == InterpreterBase.FCALL_DEF:
+            func_name = expr_ast.get("name")
+            if func_name == "print":
+                return self.__compile_print(expr_ast)
+            if func_name == "inputi" or func_name == "inputs":
+                return self.__compile_input(expr_ast)
+            return self.__compile_fcall(expr_ast)
+        if kind in self.interpreter.BIN_OPS:
+            return self.__compile_op(expr_ast)
+        if kind == InterpreterBase.NEG_DEF:
+            return self.__compile_unary(expr_ast, Type.INT, lambda x: -1 * x)
+        if kind == InterpreterBase.NOT_DEF:
+            return self.__compile_unary(expr_ast, Type.BOOL, lambda x: not x)
+        if kind == InterpreterBase.LAMBDA_DEF:
+            env = self.env
+            return lambda: Value(Type.CLOSURE, Closure(expr_ast, env))
+        if kind == InterpreterBase.OBJ_DEF:
+            return lambda: Value(Type.OBJECT, Object())
+        return lambda: None
+
+    def __compile_literal(self, value_obj):
+        return lambda: value_obj
+
+    def __compile_name(self, name_ast):
+        var_name, object_var_name = self.interpreter.split_var_name(name_ast.get("name"))
+        lookup_name = self.interpreter.lookup_name
+        if object_var_name == "proto":
+            return lambda: lookup_name(var_name, object_var_name)
+        if object_var_name is not None:
+            lookup_field = self.interpreter.lookup_field
+            field_cache = FieldCache(object_var_name)
+            return lambda: lookup_field(var_name, field_cache)
+        get = self.env.get
+
+        def eval_var():
+            val = get(var_name)
+            if val is not None:
+                return val
+            return lookup_name(var_name, None)
+
+        return eval_var
+
+    def __compile_op(self, arith_ast):
+        operation = arith_ast.elem_type
+        left = self.__compile_expr(arith_ast.get("op1"))
+        right = self.__compile_expr(arith_ast.get("op2"))
+        eval_bin_op = self.interpreter.eval_bin_op
+        quickened = None
+
+        def eval_op():
+            nonlocal quickened
+            left_value_obj = left()
+            right_value_obj = right()
+            if quickened is None:
+                quickened = quicken_op(operation, left_value_obj, right_value_obj)
+            operand_type, make_result, f = quickened
+            if left_value_obj.t is operand_type and right_value_obj.t is operand_type:
+                return make_result(f(left_value_obj.v, right_value_obj.v))
+            return eval_bin_op(operation, left_value_obj, right_value_obj)
+
+        return eval_op
+
+    def __compile_unary(self, arith_ast, t, f):
+        operation = arith_ast.elem_type
+        operand = self.__compile_expr(arith_ast.get("op1"))
+        eval_unary_op = self.interpreter.eval_unary_op
+
+        make_result = int_value if t is Type.INT else bool_value
+
+        def eval_unary():
+            value_obj = operand()
+            if value_obj.t is t:
+                return make_result(f(value_obj.v))
+            return eval_unary_op(operation, t, f, value_obj)
+
+        return eval_unary
+
+    def __compile_args(self, call_ast):
+        return tuple(self.__compile_expr(arg) for arg in call_ast.get("args"))
+
+    # for each argument that is a variable, a function returning its Cell for
+    # when it is passed to a ref parameter; None for other arguments
+    def __compile_ref_args(self, call_ast):
+        lookup_cell = self.interpreter.lookup_cell
+        ref_args = []
+        for arg in call_ast.get("args"):
+            if arg.elem_type != InterpreterBase.VAR_DEF:
+                ref_args.append(None)
+                continue
+            var_name, object_var_name = self.interpreter.split_var_name(arg.get("name"))
+            ref_args.append(
+                lambda var_name=var_name, object_var_name=object_var_name: lookup_cell(
+                    var_name, object_var_name
+                )
+            )
+        return tuple(ref_args)
+
+    def __compile_print(self, call_ast):
+        args = self.__compile_args(call_ast)
+        interpreter = self.interpreter
+        nil_value = self.nil_value
+
+        def call_print():
+            output = []
+            for arg in args:
+                output.append(printable_arg(arg()))
+            interpreter.output("".join(output))
+            return nil_value
+
+        return call_print
+
+    def __compile_input(self, call_ast):
+        args = self.__compile_args(call_ast)
+        interpreter = self.interpreter
+        func_name = call_ast.get("name")
+        if func_name == "inputi":
+            make_result = lambda inp: int_value(int(inp))
+        else:
+            make_result = string_value
+
+        def call_input():
+            if len(args) == 1:
+                interpreter.output(get_printable(args[0]()))
+            elif len(args) > 1:
+                interpreter.error(
+                    ErrorType.NAME_ERROR, f"No {func_name}() function that takes > 1 parameter"
+                )
+            return make_result(interpreter.get_input())
+
+        return call_input
+
+    def __compile_fcall(self, call_ast):
+        func_name = call_ast.get("name")
+        args = self.__compile_args(call_ast)
+        ref_args = self.__compile_ref_args(call_ast)
+        num_args = len(args)
+        call_site = CallSite(func_name, num_args)
+        resolve_call = self.interpreter.resolve_call
+        prepare_env = self.interpreter.prepare_env_with_closed_variables
+        invoke = self.__invoke
+
+        def call_func():
+            target_closure = resolve_call(call_site)
+            new_env = {}
+            if target_closure.captured_env:
+                prepare_env(target_closure, new_env)
+            return invoke(target_closure, args, ref_args, new_env)
+
+        return call_func
+
+    def __compile_mcall(self, call_ast):
+        mfunc_objref = call_ast.get("objref")
+        mfunc_name = call_ast.get("name")
+        args = self.__compile_args(call_ast)
+        ref_args = self.__compile_ref_args(call_ast)
+        num_args = len(args)
+        call_site = CallSite(mfunc_name, num_args, mfunc_objref)
+        resolve_call = self.interpreter.resolve_call
+        prepare_env = self.interpreter.prepare_env_with_closed_variables
+        bind_this = self.interpreter.bind_this
+        invoke = self.__invoke
+
+        def call_mfunc():
+            target_closure = resolve_call(call_site)
+            new_env = {}
+            if target_closure.captured_env:
+                prepare_env(target_closure, new_env)
+            return invoke(target_closure, args, ref_args, new_env, mfunc_objref, bind_this)
+
+        return call_mfunc
+
+    # evaluates the arguments into new_env and runs the target's body in it;
+    # bind_this is only passed for method calls, after the arguments as in
+    # the tree walker
+    def __invoke(self, target_closure, args, ref_args, new_env, mfunc_objref=None, bind_this=None):
+        params, body = self.__get_function(target_closure.func_ast)
+        for (arg_name, by_ref), arg, ref_arg in zip(params, args, ref_args):
+            if not by_ref:
+                new_env[arg_name] = Cell(copy_value(arg()))
+            elif ref_arg is not None:
+                new_env[arg_name] = ref_arg()
+            else:
+                new_env[arg_name] = Cell(arg())
+        if bind_this is not None:
+            bind_this(mfunc_objref, new_env)
+        self.env.push(new_env)
+        return_val = body()
+        self.env.pop()
+        if return_val is None:
+            return self.nil_value
+        return return_val
@@ -1,18 +1,35 @@
 class Element:
-    def __init__(self, elem_type, **kwargs):
-        self.elem_type = elem_type
-        self.dict = {}
+    # a node holds its type and a slot for each of its fields, and nothing
+    # else: every set of field names gets its own subclass with those slots
+    # (see node_class); __weakref__ lets analyses cache results per node
+    # without keeping it alive
+    __slots__ = ("elem_type", "__weakref__")
+
+    fields = ()  # the names of a node's fields, in the order they were given
+
+    def __new__(cls, elem_type, **kwargs):
+        fields = tuple(kwargs)
+        node = object.__new__(NODE_CLASSES.get(fields) or node_class(fields))
+        node.elem_type = elem_type
         for key, value in kwargs.items():
-            self.dict[key] = value
+            setattr(node, key, value)
+        return node
+
+    # ast nodes are never modified, so deep copies of closures can share them
+    # (the compiled engines look up a function's code by its ast node)
+    def __deepcopy__(self, memo):
+        return self
 
     def get(self, key):
-        if key not in self.dict:
-            return None
-        return self.dict[key]
+        return getattr(self, key, None)
+
+    # the node's (field name, value) pairs
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.fields]
 
     def __str__(self):
         s = f"{self.elem_type}: "
-        for key, value in self.dict.items():
+        for key, value in self.items():
             s += key + ": " + self.__val(value) + ", "
         return s[0:-2]
 
@@ -27,3 +44,14 @@ class Element:
                 return "[" + s[0:-2] + "]"
             return "[" + s + "]"
         return str(v)
+
+
+# field names -> the subclass of Element for nodes with them; the grammar
+# only has a few node layouts, so there are only ever a few of these
+NODE_CLASSES = {}
+
+
+def node_class(fields):
+    cls = type("Element", (Element,), {"__slots__": fields, "fields": fields})
+    NODE_CLASSES[fields] = cls
+    return cls
@@ -1,5 +1,14 @@
+from type_valuev4 import Cell
+
+# pushed for a block until it creates a variable, so blocks that never do
+# don't allocate a scope; it's never written to
+EMPTY_SCOPE = {}
+
+
 # The EnvironmentManager class keeps a mapping between each variable name (aka symbol)
-# in a brewin program and the Value object, which stores a type, and a value.
+# in a brewin program and the Cell holding its Value object, which stores a type, and a value.
+# (Or the python value itself for the ints, bools and strings of Interpreter(unboxed=True);
+# either way a Cell holding None is a variable that isn't visible yet.)
 class EnvironmentManager:
     def __init__(self):
         self.environment = [{}]
@@ -7,36 +16,45 @@ class EnvironmentManager:
     def environ(self):
         return self.environment
 
-    # returns a VariableDef object
+    # returns a Value object, or None
     def get(self, symbol):
         for env in reversed(self.environment):
             if symbol in env:
-                return env[symbol]
+                return env[symbol].value
 
         return None
 
-    def set(self, symbol, value, force_new_var_creation=False):
-        if force_new_var_creation:
-            self.environment[-1][symbol] = value
-            return
-
+    # returns the Cell of the variable, so it can be shared
+    def get_cell(self, symbol):
         for env in reversed(self.environment):
             if symbol in env:
-                env[symbol] = value
-                return
+                return env[symbol]
+
+        return None
+
+    def set(self, symbol, value, force_new_var_creation=False):
+        if not force_new_var_creation:
+            for env in reversed(self.environment):
+                if symbol in env:
+                    env[symbol].value = value
+                    return
 
         # symbol not found anywhere in the environment
-        self.environment[-1][symbol] = value
+        self.create(symbol, value)
 
     # create a new symbol in the top-most environment, regardless of whether that symbol exists
     # in a lower environment
     def create(self, symbol, value):
-        self.environment[-1][symbol] = value
+        scope = self.environment[-1]
+        if scope is EMPTY_SCOPE:
+            scope = self.environment[-1] = {}
+        scope[symbol] = Cell(value)
 
-    # used when we enter a nested block to create a new environment for that block
+    # used when we enter a nested block to create a new environment for that block;
+    # env maps names to Cells
     def push(self, env = None):
         if env is None:
-            self.environment.append({})  # [{}] -> [{}, {}]
+            self.environment.append(EMPTY_SCOPE)  # [{}] -> [{}, {}]
         else:
             self.environment.append(env)
 
@@ -47,11 +65,90 @@ class EnvironmentManager:
     def __enumerate(self):
         captured_so_far = set()
         for captured in reversed(self.environment):
-            for var_name, value in captured.items():
+            for var_name, cell in captured.items():
                 if var_name in captured_so_far:
                     continue
                 captured_so_far.add(var_name)
-                yield (var_name, value)
+                yield (var_name, cell)
+
+    def __iter__(self):
+        return self.__enumerate()
+
+
+# The same interface as EnvironmentManager, with shallow binding: every name
+# has a stack of the Cells bound to it, innermost last, so get and set don't
+# depend on how many scopes are open. The scopes are kept as well; each one
+# is the undo log of the names it bound, which are unbound when it's popped.
+class ShallowEnvironmentManager:
+    def __init__(self):
+        self.environment = [{}]
+        self.bindings = {}  # name -> Cells bound to it, innermost last
+
+    def environ(self):
+        return self.environment
+
+    # returns a Value object
+    def get(self, symbol):
+        cells = self.bindings.get(symbol)
+        if cells:
+            return cells[-1].value
+        return None
+
+    # returns the Cell of the variable, so it can be shared
+    def get_cell(self, symbol):
+        cells = self.bindings.get(symbol)
+        if cells:
+            return cells[-1]
+        return None
+
+    def set(self, symbol, value, force_new_var_creation=False):
+        if not force_new_var_creation:
+            cells = self.bindings.get(symbol)
+            if cells:
+                cells[-1].value = value
+                return
+        self.create(symbol, value)
+
+    # create a new symbol in the top-most environment, regardless of whether that symbol exists
+    # in a lower environment
+    def create(self, symbol, value):
+        cell = Cell(value)
+        scope = self.environment[-1]
+        if scope is EMPTY_SCOPE:
+            scope = self.environment[-1] = {}
+        cells = self.bindings.get(symbol)
+        if cells is None:
+            self.bindings[symbol] = [cell]
+        elif symbol in scope:
+            cells[-1] = cell
+        else:
+            cells.append(cell)
+        scope[symbol] = cell
+
+    # env maps names to Cells, and mustn't be changed while it's pushed
+    # other than through this class
+    def push(self, env=None):
+        if env is None:
+            self.environment.append(EMPTY_SCOPE)
+            return
+        self.environment.append(env)
+        bindings = self.bindings
+        for symbol, cell in env.items():
+            cells = bindings.get(symbol)
+            if cells is None:
+                bindings[symbol] = [cell]
+            else:
+                cells.append(cell)
+
+    def pop(self):
+        bindings = self.bindings
+        for symbol in self.environment.pop():
+            bindings[symbol].pop()
+
+    def __enumerate(self):
+        for var_name, cells in self.bindings.items():
+            if cells:
+                yield (var_name, cells[-1])
 
     def __iter__(self):
         return self.__enumerate()
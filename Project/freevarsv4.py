@@ -0,0 +1,75 @@
+import weakref
+
+from intbase import InterpreterBase
+
+# lambda ast -> its free variables (or None), see free_variables
+_free_variables = weakref.WeakKeyDictionary()
+
+
+# Returns the names a lambda needs to capture: every variable its body reads
+# or assigns (including the object of o.f) that isn't one of its parameters,
+# and the free variables of the lambdas it creates. Variables are scoped
+# dynamically, so a function called from the body could use any variable
+# visible to the lambda; when the body (or a lambda inside it) calls anything
+# but print, inputi or inputs, None is returned and everything has to be
+# captured.
+def free_variables(lambda_ast):
+    if lambda_ast not in _free_variables:
+        _free_variables[lambda_ast] = _find_free_variables(lambda_ast)
+    return _free_variables[lambda_ast]
+
+
+def _find_free_variables(lambda_ast):
+    names = set()
+    try:
+        _visit_statements(lambda_ast.get("statements"), names)
+    except _CapturesEverything:
+        return None
+    for formal_ast in lambda_ast.get("args"):
+        names.discard(formal_ast.get("name"))
+    return frozenset(names)
+
+
+class _CapturesEverything(Exception):
+    pass
+
+
+def _visit_statements(statements, names):
+    for statement in statements:
+        kind = statement.elem_type
+        if kind == InterpreterBase.FCALL_DEF or kind == InterpreterBase.MCALL_DEF:
+            _visit_expr(statement, names)
+        elif kind == "=":
+            names.add(statement.get("name").split(".")[0])
+            _visit_expr(statement.get("expression"), names)
+        elif kind == InterpreterBase.RETURN_DEF:
+            if statement.get("expression") is not None:
+                _visit_expr(statement.get("expression"), names)
+        elif kind == InterpreterBase.IF_DEF or kind == InterpreterBase.WHILE_DEF:
+            _visit_expr(statement.get("condition"), names)
+            _visit_statements(statement.get("statements"), names)
+            if statement.get("else_statements") is not None:
+                _visit_statements(statement.get("else_statements"), names)
+        # other statements are never executed
+
+
+def _visit_expr(expr_ast, names):
+    kind = expr_ast.elem_type
+    if kind == InterpreterBase.VAR_DEF:
+        names.add(expr_ast.get("name").split(".")[0])
+    elif kind == InterpreterBase.FCALL_DEF:
+        if expr_ast.get("name") not in ("print", "inputi", "inputs"):
+            raise _CapturesEverything()
+        for arg in expr_ast.get("args"):
+            _visit_expr(arg, names)
+    elif kind == InterpreterBase.MCALL_DEF:
+        raise _CapturesEverything()
+    elif kind == InterpreterBase.LAMBDA_DEF:
+        nested = free_variables(expr_ast)
+        if nested is None:
+            raise _CapturesEverything()
+        names.update(nested)
+    else:
+        for operand in ("op1", "op2"):
+            if expr_ast.get(operand) is not None:
+                _visit_expr(expr_ast.get(operand), names)
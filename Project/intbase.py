@@ -1,4 +1,7 @@
 # Base class for our interpreter
+import mmap
+import os
+from collections import deque
 from enum import Enum
 
 
@@ -9,6 +12,197 @@ class ErrorType(Enum):
     # Add others here
 
 
+# Output sinks receive every line a program outputs. ConsoleSink prints each
+# line as it's output; BufferedSink collects them and writes them to a file
+# descriptor in blocks of about buffer_size bytes (0 writes every line).
+# A sink is flushed before reading input from the keyboard, and
+# interpreters flush it once a run is over.
+class ConsoleSink:
+    def __init__(self, file=None):
+        self.file = file  # None is sys.stdout
+
+    def write(self, line):
+        print(line, file=self.file)
+
+    def flush(self):
+        pass
+
+
+class BufferedSink:
+    def __init__(self, fd=1, buffer_size=1 << 16, encoding="utf-8"):
+        self.fd = fd
+        self.buffer_size = buffer_size
+        self.encoding = encoding
+        self.lines = []
+        self.size = 0  # characters in lines, counting newlines
+
+    # lines that aren't strings, such as the None an inputi(nil) prompt
+    # outputs, are written the way print writes them
+    def write(self, line):
+        line = str(line)
+        self.lines.append(line)
+        self.size += len(line) + 1
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    # the lines are only dropped once they've all been written, so a failed
+    # write leaves them to the next flush
+    def flush(self):
+        if not self.lines:
+            return
+        data = ("\n".join(self.lines) + "\n").encode(self.encoding)
+        while data:
+            written = os.write(self.fd, data)
+            data = data[written:]
+        self.lines = []
+        self.size = 0
+
+
+# Input sources give get_input the lines a program reads, without their line
+# endings (a \r before a \n included, whichever source reads them), and
+# None once there are no more. The sources reading files take a block of
+# lines at a time, so input of any size is read in constant memory.
+# get_input flushes the output before reading from the console. close
+# releases whatever a source opened itself, which interpreters do when a run
+# is over; sources are context managers that close on exit as well.
+class InputSource:
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConsoleSource(InputSource):
+    def read_line(self):
+        return input().removesuffix("\r")
+
+
+class ListSource(InputSource):
+    def __init__(self, lines):
+        self.lines = lines
+        self.cursor = 0
+
+    def read_line(self):
+        if self.cursor < len(self.lines):
+            line = self.lines[self.cursor]
+            self.cursor += 1
+            return line
+        return None
+
+
+# any iterable of lines, such as a generator or an open text file
+class IteratorSource(InputSource):
+    def __init__(self, lines):
+        self.lines = iter(lines)
+
+    def read_line(self):
+        line = next(self.lines, None)
+        if line is None:
+            return None
+        return line.removesuffix("\n").removesuffix("\r")
+
+
+# splits the blocks of bytes returned by read_block into lines
+class BlockSource(InputSource):
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.lines = []
+        self.cursor = 0
+        self.partial = b""  # the start of a line the next block ends
+
+    def read_line(self):
+        if self.cursor == len(self.lines) and not self.__next_lines():
+            return None
+        line = self.lines[self.cursor]
+        self.cursor += 1
+        return line
+
+    def __next_lines(self):
+        while True:
+            block = self.read_block()
+            if not block:
+                if not self.partial:
+                    return False
+                # the last line has no line ending
+                self.lines = [self.partial.decode(self.encoding).removesuffix("\r")]
+                self.partial = b""
+                break
+            data = self.partial + block
+            end = data.rfind(b"\n")
+            if end < 0:
+                self.partial = data
+                continue
+            self.partial = data[end + 1 :]
+            text = data[:end].decode(self.encoding)
+            if "\r" in text:
+                self.lines = [line.removesuffix("\r") for line in text.split("\n")]
+            else:
+                self.lines = text.split("\n")
+            break
+        self.cursor = 0
+        return True
+
+
+# reads a file descriptor buffer_size bytes at a time; the descriptor is
+# the caller's to close
+class FileSource(BlockSource):
+    def __init__(self, fd, buffer_size=1 << 16, encoding="utf-8"):
+        super().__init__(encoding)
+        self.fd = fd
+        self.buffer_size = buffer_size
+
+    def read_block(self):
+        return os.read(self.fd, self.buffer_size)
+
+
+# maps a file into memory and takes it prefetch bytes at a time, asking the
+# os to read the next ones ahead where it can
+class MappedFileSource(BlockSource):
+    def __init__(self, path, prefetch=1 << 20, encoding="utf-8"):
+        super().__init__(encoding)
+        self.prefetch = prefetch
+        self.offset = 0
+        with open(path, "rb") as file:
+            # an empty file can't be mapped
+            if os.fstat(file.fileno()).st_size == 0:
+                self.map = b""
+            else:
+                self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(mmap, "MADV_SEQUENTIAL"):
+                    self.map.madvise(mmap.MADV_SEQUENTIAL)
+
+    def close(self):
+        if self.map:
+            self.map.close()
+        self.map = b""
+        self.offset = 0
+
+    def read_block(self):
+        start = self.offset
+        self.offset = min(start + self.prefetch, len(self.map))
+        if self.offset < len(self.map) and hasattr(mmap, "MADV_WILLNEED"):
+            ahead = self.offset - self.offset % mmap.PAGESIZE  # has to be page aligned
+            length = min(self.offset + self.prefetch, len(self.map)) - ahead
+            self.map.madvise(mmap.MADV_WILLNEED, ahead, length)
+        return self.map[start : self.offset]
+
+
+# the input source for the inp of an interpreter: a source, a list of lines
+# or any other iterable of them; without any, input is read from the console
+def input_source(inp):
+    if not inp:
+        return ConsoleSource()
+    if hasattr(inp, "read_line"):
+        return inp
+    if isinstance(inp, (list, tuple)):
+        return ListSource(inp)
+    return IteratorSource(inp)
+
+
 class InterpreterBase:
     # AST node types
     PROGRAM_DEF = "program"
@@ -34,15 +228,27 @@ class InterpreterBase:
     NOT_DEF = "!"
 
     # methods
-    def __init__(self, console_output=True, inp=None):
+    # output_sink replaces the ConsoleSink of console_output; max_output_log
+    # keeps only the last that many lines of output for get_output (0 keeps
+    # none), instead of all of them
+    def __init__(self, console_output=True, inp=None, output_sink=None, max_output_log=None):
         self.console_output = console_output
-        self.inp = inp  # if not none, then read input from passed-in list
+        if output_sink is None and console_output:
+            output_sink = ConsoleSink()
+        self.output_sink = output_sink
+        self.max_output_log = max_output_log
+        self.inp = inp  # if not none, then read input from it, see input_source
         self.reset()
 
     # Call to reset I/O for another run of the program
     def reset(self):
-        self.output_log = []
-        self.input_cursor = 0
+        if self.max_output_log is None:
+            self.output_log = []
+        elif self.max_output_log == 0:
+            self.output_log = None
+        else:
+            self.output_log = deque(maxlen=self.max_output_log)
+        self.input_source = input_source(self.inp)
         self.error_type = None
         self.error_line = None
 
@@ -51,14 +257,9 @@ class InterpreterBase:
         pass
 
     def get_input(self):
-        if not self.inp:
-            return input()  # Get input from keyboard if not input list provided
-
-        if self.input_cursor < len(self.inp):
-            cur_input = self.inp[self.input_cursor]
-            self.input_cursor += 1
-            return cur_input
-        return None
+        if self.input_source.__class__ is ConsoleSource:
+            self.flush_output()  # so any prompt is shown first
+        return self.input_source.read_line()
 
     # students must call this for any errors that they run into
     def error(self, error_type, description=None, line_num=None):
@@ -75,11 +276,23 @@ class InterpreterBase:
         raise Exception(f"{error_type} on line {line_num}{description}")
 
     def output(self, v):
-        if self.console_output:
-            print(v)
-        self.output_log.append(v)
+        if self.output_sink is not None:
+            self.output_sink.write(v)
+        if self.output_log is not None:
+            self.output_log.append(v)
+
+    def close_input(self):
+        self.input_source.close()
+
+    def flush_output(self):
+        if self.output_sink is not None:
+            self.output_sink.flush()
 
     def get_output(self):
+        if self.output_log is None:
+            return []
+        if self.max_output_log is not None:
+            return list(self.output_log)
         return self.output_log
 
     def get_error_type_and_line(self):
@@ -1,15 +1,42 @@
-import copy
 from enum import Enum
+from functools import partial
 
-from brewparse import parse_program
-from env_v4 import EnvironmentManager
+from brewparse import PARSERS, parse_program
+from env_v4 import EnvironmentManager, ShallowEnvironmentManager
 from intbase import InterpreterBase, ErrorType
-from type_valuev4 import Object, Closure, Type, Value, create_value, get_printable
+from type_valuev4 import (
+    CallSite,
+    Cell,
+    Object,
+    Closure,
+    FieldCache,
+    Type,
+    PYTHON_TYPES,
+    Value,
+    bool_value,
+    box,
+    concat_strings,
+    copy_value,
+    create_value,
+    get_printable,
+    int_value,
+    literal_value,
+    printable_arg,
+    reset_shapes,
+    type_of,
+    unbox,
+)
+from closure_compilerv4 import ClosureCompiler, quicken_op, quicken_unboxed_op
+from optimizerv4 import dump_ast, may_create_variable, optimize_program
+from parse_cachev4 import ParseCache
+from pycompilerv4 import PythonRuntime, get_compiled_program
+from vmv4 import VirtualMachine
 
 
 class ExecStatus(Enum):
     CONTINUE = 1
     RETURN = 2
+    TAIL_CALL = 3  # the value is the call to make, see __do_return
 
 
 # Main interpreter class
@@ -18,24 +45,124 @@ class Interpreter(InterpreterBase):
     NIL_VALUE = create_value(InterpreterBase.NIL_DEF)
     TRUE_VALUE = create_value(InterpreterBase.TRUE_DEF)
     BIN_OPS = {"+", "-", "*", "/", "==", "!=", ">", ">=", "<", "<=", "||", "&&"}
+    ENGINES = {"tree", "closure", "vm", "python"}
+    ENVIRONMENTS = {"deep": EnvironmentManager, "shallow": ShallowEnvironmentManager}
 
     # methods
-    def __init__(self, console_output=True, inp=None, trace_output=False):
-        super().__init__(console_output, inp)
+    # engine selects how function bodies are executed: "tree" walks the ast
+    # directly, "closure" compiles it into nested python closures first and
+    # "vm" compiles it to bytecode (see bytecodev4.py) run by a stack machine
+    # that keeps brewin calls on its own frame stack instead of python's, so
+    # deep recursion doesn't hit python's recursion limit, and "python"
+    # translates every function into a python function once per program text
+    # (see pycompilerv4.py)
+    # environment selects how variables are bound: "deep" searches the open
+    # scopes innermost first, "shallow" keeps a stack of Cells per name so
+    # lookups don't depend on the depth of the call stack (see env_v4.py)
+    # optimize runs the parsed program through optimizerv4 first, unless
+    # trace_output is set so the trace follows the program as written, and
+    # dump_ast prints the ast that is actually executed
+    # output_sink and max_output_log are described in intbase.py
+    # parse_cache is a ParseCache, or the directory of one, that programs are
+    # parsed through so that the same program is only parsed once
+    # parser is the parser of brewparse.parse_program that programs are
+    # parsed with, "lalr" or "descent"
+    # unboxed makes the tree walker represent ints, bools and strings by the
+    # python value itself instead of a Value (see type_valuev4.type_of), so
+    # arithmetic doesn't allocate; the other engines only handle Values
+    def __init__(
+        self,
+        console_output=True,
+        inp=None,
+        trace_output=False,
+        engine="tree",
+        environment="shallow",
+        optimize=False,
+        dump_ast=False,
+        unboxed=False,
+        output_sink=None,
+        max_output_log=None,
+        parse_cache=None,
+        parser="lalr",
+    ):
+        super().__init__(console_output, inp, output_sink, max_output_log)
+        if engine not in Interpreter.ENGINES:
+            raise ValueError(f"Unknown engine {engine}")
+        if environment not in Interpreter.ENVIRONMENTS:
+            raise ValueError(f"Unknown environment {environment}")
+        if unboxed and engine != "tree":
+            raise ValueError(f"Unboxed values aren't supported by the {engine} engine")
+        if parser not in PARSERS:
+            raise ValueError(f"Unknown parser {parser}")
         self.trace_output = trace_output
+        self.engine = engine
+        self.environment = environment
+        self.optimize = optimize and not trace_output
+        self.dump_ast = dump_ast
+        self.unboxed = unboxed
+        if isinstance(parse_cache, str):
+            parse_cache = ParseCache(parse_cache)
+        self.parse_cache = parse_cache
+        self.parser = parser
+        # what the tree walker makes of literals and input
+        if unboxed:
+            self.make_int, self.make_bool, self.make_string = int, bool, str
+            self.__eval_op = self.__eval_unboxed_op
+            self.__eval_unary = self.__eval_unboxed_unary
+            self.eval_condition = self.__eval_unboxed_condition
+        else:
+            self.make_int, self.make_bool = int_value, bool_value
+            self.make_string = partial(literal_value, Type.STRING)
         self.__setup_ops()
 
     # run a program that's provided in a string
     # usese the provided Parser found in brewparse.py to parse the program
     # into an abstract syntax tree (ast)
     def run(self, program):
-        ast = parse_program(program)
+        try:
+            self.__run(program)
+        finally:
+            try:
+                self.flush_output()
+            finally:
+                self.close_input()
+
+    def __run(self, program):
+        if self.engine == "python":
+            ast, functions = get_compiled_program(
+                program, self.trace_output, self.optimize, self.parse_cache, self.parser
+            )
+        else:
+            if self.parse_cache is None:
+                ast = parse_program(program, self.parser)
+            else:
+                ast = self.parse_cache.parse(program, self.parser)
+            if self.optimize:
+                ast = optimize_program(ast)
+        if self.dump_ast:
+            print(dump_ast(ast))
         self.__set_up_function_table(ast)
-        self.env = EnvironmentManager()
-        main_func = self.__get_func_by_name("main", 0)
+        reset_shapes()
+        self.env = Interpreter.ENVIRONMENTS[self.environment]()
+        self.frame_base = 0  # index of the running function's first scope
+        self.quickened_ops = {}  # operator ast -> handler, see __eval_op
+        self.call_sites = {}  # call ast -> (CallSite, arguments), see __call_site
+        self.param_plans = {}  # function ast -> (name, by ref) per parameter
+        self.field_caches = {}  # o.f ast -> FieldCache, see lookup_field
+        self.block_scopes = {}  # id of a block's statements -> whether it needs a scope
+        main_func = self.get_func_by_name("main", 0)
         if main_func is None:
             super().error(ErrorType.NAME_ERROR, f"Function not found")
-        self.__run_statements(main_func.func_ast.get("statements"))
+        if self.engine == "closure":
+            ClosureCompiler(self).run(main_func)
+            return
+        if self.engine == "vm":
+            VirtualMachine(self).run(main_func)
+            return
+        if self.engine == "python":
+            PythonRuntime(self, functions).run(main_func)
+            return
+        self.__run_function(main_func.func_ast, {})
 
     def __set_up_function_table(self, ast):
         self.func_name_to_ast = {}
@@ -47,7 +174,10 @@ class Interpreter(InterpreterBase):
                 self.func_name_to_ast[func_name] = {}
             self.func_name_to_ast[func_name][num_params] = Closure(func_def, empty_env)
 
-    def __get_func_by_name(self, name, num_params, objName=None):
+    # The methods below up to __run_statements hold the language semantics that
+    # don't need to evaluate any ast themselves, so the compiled engines share
+    # them with the tree walker and raise exactly the same errors.
+    def get_func_by_name(self, name, num_params, objName=None):
         if name not in self.func_name_to_ast:
             if objName is None:
                 closure_val_obj = self.env.get(name)
@@ -56,7 +186,7 @@ class Interpreter(InterpreterBase):
             if closure_val_obj is None:
                 return None
                 # super().error(ErrorType.NAME_ERROR, f"Function {name} not found")
-            if closure_val_obj.type() != Type.CLOSURE:
+            if closure_val_obj.__class__ is not Value or closure_val_obj.t is not Type.CLOSURE:
                 super().error(
                     ErrorType.TYPE_ERROR, "Trying to call function with non-closure"
                 )
@@ -89,8 +219,255 @@ class Interpreter(InterpreterBase):
             )
         return candidate_funcs[num_params]
 
-    def __run_statements(self, statements):
-        self.env.push()
+    def get_callable(self, func_name, num_params):
+        target_closure = self.get_func_by_name(func_name, num_params)
+        if target_closure == None:
+            super().error(ErrorType.NAME_ERROR, f"Function {func_name} not found")
+        if target_closure.type != Type.CLOSURE:
+            super().error(ErrorType.TYPE_ERROR, f"Function {func_name} is changed to non-function type.")
+        return target_closure
+
+    def get_method(self, mfunc_objref, mfunc_name, num_params):
+        if self.env.get(mfunc_objref) is None:
+            super().error(ErrorType.NAME_ERROR, f"Object {mfunc_objref} does not exist")
+
+        if type_of(self.env.get(mfunc_objref)) is not Type.OBJECT:
+            super().error(ErrorType.TYPE_ERROR, f"{mfunc_objref} is of non-object type")
+
+        target_closure = self.get_func_by_name(mfunc_objref, num_params, mfunc_name)
+        if target_closure == None:
+            super().error(ErrorType.NAME_ERROR, f"Function {mfunc_objref}.{mfunc_name} not found")
+        if target_closure.type != Type.CLOSURE:
+            super().error(ErrorType.TYPE_ERROR, f"Function {mfunc_objref}.{mfunc_name} is changed to non-function type.")
+        return target_closure
+
+    # get_callable/get_method for a call node, remembering the result in its
+    # CallSite. The checks skipped on a hit can't have a different outcome:
+    # the function table doesn't change during a run and Values are
+    # immutable. Only a closure's type can be changed by assigning to a
+    # variable it was assigned to, so that's checked on every call.
+    def resolve_call(self, call_site):
+        func_name = call_site.func_name
+        mfunc_objref = call_site.mfunc_objref
+        target_closure = call_site.func_closure
+        if target_closure is None:
+            if mfunc_objref is None:
+                if func_name in self.func_name_to_ast:
+                    target_closure = self.get_callable(func_name, call_site.num_params)
+                    call_site.func_closure = target_closure
+                    return target_closure
+                value_obj = self.env.get(func_name)
+            else:
+                # get_func_by_name looks an object's name up in the function
+                # table first, so that call is never cached
+                if mfunc_objref in self.func_name_to_ast:
+                    return self.get_method(mfunc_objref, func_name, call_site.num_params)
+                obj_value = self.env.get(mfunc_objref)
+                if obj_value.__class__ is not Value or obj_value.t is not Type.OBJECT:
+                    return self.get_method(mfunc_objref, func_name, call_site.num_params)
+                value_obj = call_site.field_cache.get(obj_value.v)
+            if value_obj is None or value_obj is not call_site.value_obj:
+                if mfunc_objref is None:
+                    target_closure = self.get_callable(func_name, call_site.num_params)
+                else:
+                    target_closure = self.get_method(mfunc_objref, func_name, call_site.num_params)
+                call_site.value_obj = value_obj
+                call_site.closure = target_closure
+                return target_closure
+            target_closure = call_site.closure
+        if target_closure.type != Type.CLOSURE:
+            if mfunc_objref is not None:
+                func_name = f"{mfunc_objref}.{func_name}"
+            super().error(ErrorType.TYPE_ERROR, f"Function {func_name} is changed to non-function type.")
+        return target_closure
+
+    def prepare_env_with_closed_variables(self, target_closure, temp_env):
+        for var_name, cell in target_closure.captured_cells().items():
+            # Updated here - ignore updates to the scope if we
+            #   altered a parameter, or if the argument is a similarly named variable
+            value_obj = cell.value
+            if value_obj.__class__ is Value and (
+                value_obj.t is Type.CLOSURE or value_obj.t is Type.OBJECT
+            ):
+                current_cell = self.env.get_cell(var_name)
+                if current_cell is None or current_cell.value is None:
+                    # hides var_name until the closure assigns to it
+                    current_cell = Cell()
+                temp_env[var_name] = current_cell
+                continue
+            temp_env[var_name] = cell
+
+    # this shares the Cell of the object variable the method was called on.
+    # (It used to be compared with an enclosing this first, but a Value never
+    # equals the name of a variable, so the answer was always the same.)
+    def bind_this(self, mfunc_objref, temp_env):
+        temp_env['this'] = self.env.get_cell(mfunc_objref)
+
+    def split_var_name(self, var_name):
+        parts = var_name.split('.')
+        if len(parts) == 2:
+            return parts[0], parts[1]
+        elif len(parts) == 1:
+            return parts[0], None
+        else:
+            return None, None
+
+    def assign_value(self, var_name, object_var_name, value_obj):
+        src_value_obj = value_obj
+        target_cell = self.env.get_cell(var_name)
+        target_value_obj = None if target_cell is None else target_cell.value
+        if target_value_obj is None:
+            if object_var_name is not None:
+                super().error(
+                    ErrorType.NAME_ERROR,
+                    f"Object {var_name} does not exist"
+                )
+            self.env.set(var_name, src_value_obj)
+
+        else:
+            # unboxed values are never closures or objects
+            target_type = target_value_obj.t if target_value_obj.__class__ is Value else None
+            # if a close is changed to another type such as int, we cannot make function calls on it any more 
+            if target_type == Type.CLOSURE and type_of(src_value_obj) != Type.CLOSURE:
+                target_value_obj.v.type = type_of(src_value_obj)
+            if target_type == Type.OBJECT:
+                if object_var_name == "proto":
+                    src_type = type_of(src_value_obj)
+                    if not (src_type is Type.OBJECT or src_type is Type.NIL):
+                        super().error(ErrorType.TYPE_ERROR, f"You cannot have a prototype of non-object type")
+                    if src_type is Type.NIL:
+                        target_value_obj.v.setProto(None)
+                    else:
+                        target_value_obj.v.setProto(src_value_obj)
+                elif object_var_name is None:
+                    target_cell.value = src_value_obj
+                else:
+                    target_value_obj.v.addOrUpdate(object_var_name, src_value_obj)
+            elif object_var_name is not None:
+                super().error(
+                    ErrorType.TYPE_ERROR,
+                    f"{var_name} is of non-object type"
+                )
+            else:
+                target_cell.value = src_value_obj
+
+    # lookup_name for a field read through the FieldCache of its access site
+    def lookup_field(self, var_name, field_cache):
+        val = self.env.get(var_name)
+        if val.__class__ is Value and val.t is Type.OBJECT:
+            value_obj = field_cache.get(val.v)
+            if value_obj is None:
+                super().error(
+                    ErrorType.NAME_ERROR, f"Variable/function {var_name}.{field_cache.symbol} not found"
+                )
+            return value_obj
+        return self.lookup_cell(var_name, field_cache.symbol).value
+
+    # fields are read without asking the object for their Cell, which would
+    # give the field one (see Object.getCell)
+    def lookup_name(self, var_name, object_var_name):
+        if object_var_name is not None and object_var_name != "proto":
+            val = self.env.get(var_name)
+            if val.__class__ is Value and val.t is Type.OBJECT:
+                value_obj = val.v.getObj(object_var_name)
+                if value_obj is None:
+                    super().error(
+                        ErrorType.NAME_ERROR, f"Variable/function {var_name}.{object_var_name} not found"
+                    )
+                return value_obj
+        return self.lookup_cell(var_name, object_var_name).value
+
+    # returns the Cell of a variable or field, which is what gets bound to a
+    # ref parameter; functions looked up by name get a new Cell
+    def lookup_cell(self, var_name, object_var_name):
+        cell = self.env.get_cell(var_name)
+        if cell is not None and cell.value is not None:
+            val = cell.value
+            is_object = val.__class__ is Value and val.t is Type.OBJECT
+            if object_var_name is not None and not is_object:
+                super().error(
+                    ErrorType.TYPE_ERROR, f"Object {var_name} is of non-object type"
+                )
+            if is_object:
+                if object_var_name is None:
+                    return cell
+
+                if object_var_name == "proto":
+                    cell = val.value().getProtoCell()
+                else:
+                    cell = val.value().getCell(object_var_name)
+
+                if cell is None:
+                    super().error(
+                        ErrorType.NAME_ERROR, f"Variable/function {var_name}.{object_var_name} not found"
+                    )
+                
+            return cell
+            
+        closure = self.get_func_by_name(var_name, None)
+        if closure is None:
+            super().error(
+                ErrorType.NAME_ERROR, f"Variable/function {var_name} not found"
+            )
+        
+        return Cell(Value(Type.CLOSURE, closure))
+
+    def eval_bin_op(self, operation, left_value_obj, right_value_obj):
+        left_value_obj, right_value_obj = self.__bin_op_promotion(
+            operation, left_value_obj, right_value_obj
+        )
+
+        if not self.__compatible_types(
+            operation, left_value_obj, right_value_obj
+        ):
+            super().error(
+                ErrorType.TYPE_ERROR,
+                f"Incompatible types for {operation} operation",
+            )
+        if operation not in self.op_to_lambda[left_value_obj.type()]:
+            super().error(
+                ErrorType.TYPE_ERROR,
+                f"Incompatible operator {operation} for type {left_value_obj.type()}",
+            )
+        f = self.op_to_lambda[left_value_obj.type()][operation]
+        return f(left_value_obj, right_value_obj)
+
+    def eval_unary_op(self, operation, t, f, value_obj):
+        value_obj = self.__unary_op_promotion(operation, value_obj)
+
+        if value_obj.type() != t:
+            super().error(
+                ErrorType.TYPE_ERROR,
+                f"Incompatible type for {operation} operation",
+            )
+        if t is Type.INT:
+            return int_value(f(value_obj.value()))
+        return bool_value(f(value_obj.value()))
+
+    # kind is the statement the condition belongs to: "if" or "while"
+    def eval_condition(self, result, kind):
+        if result.type() == Type.INT:
+            result = Interpreter.__int_to_bool(result)
+        if result.type() != Type.BOOL:
+            super().error(
+                ErrorType.TYPE_ERROR,
+                f"Incompatible type for {kind} condition",
+            )
+        return result.value()
+
+    # blocks that can't create a variable run without a scope of their own,
+    # and so do function bodies (in_frame), which create theirs in the scope
+    # holding the parameters
+    def __run_statements(self, statements, in_frame=False):
+        if in_frame:
+            scoped = False
+        else:
+            scoped = self.block_scopes.get(id(statements))
+            if scoped is None:
+                scoped = may_create_variable(statements)
+                self.block_scopes[id(statements)] = scoped
+        if scoped:
+            self.env.push()
         for statement in statements:
             if self.trace_output:
                 print(statement)
@@ -108,110 +485,136 @@ class Interpreter(InterpreterBase):
             elif statement.elem_type == Interpreter.WHILE_DEF:
                 status, return_val = self.__do_while(statement)
 
-            if status == ExecStatus.RETURN:
-                self.env.pop()
+            if status != ExecStatus.CONTINUE:
+                if scoped:
+                    self.env.pop()
                 return (status, return_val)
 
-        self.env.pop()
+        if scoped:
+            self.env.pop()
         return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
 
-    def __call_mfunc(self, call_ast):
-        mfunc_objref = call_ast.get("objref")
-        mfunc_name = call_ast.get("name")
-        actual_args = call_ast.get("args")
-
-        if self.env.get(mfunc_objref) is None:
-            super().error(ErrorType.NAME_ERROR, f"Object {mfunc_objref} does not exist")
-
-        if self.env.get(mfunc_objref).type() is not Type.OBJECT:
-            super().error(ErrorType.TYPE_ERROR, f"{mfunc_objref} is of non-object type")
+    # runs a function whose parameters are in new_env. Tail calls made by its
+    # return statements replace it here instead of nesting another call: the
+    # callee runs on top of a single scope that merges the caller's ones, so
+    # it still sees (and shares the Cells of) every variable the caller saw
+    def __run_function(self, func_ast, new_env):
+        saved_frame_base = self.frame_base
+        self.frame_base = len(self.env.environment)
+        self.env.push(new_env)
+        num_scopes = 1
+        while True:
+            status, return_val = self.__run_statements(func_ast.get("statements"), True)
+            if status != ExecStatus.TAIL_CALL:
+                break
+            func_ast, merged_env, new_env = return_val
+            for _ in range(num_scopes):
+                self.env.pop()
+            self.env.push(merged_env)
+            self.env.push(new_env)
+            num_scopes = 2
+        for _ in range(num_scopes):
+            self.env.pop()
+        self.frame_base = saved_frame_base
+        return return_val
 
-        target_closure = self.__get_func_by_name(mfunc_objref, len(actual_args), mfunc_name)
-        if target_closure == None:
-            super().error(ErrorType.NAME_ERROR, f"Function {mfunc_objref}.{mfunc_name} not found")
-        if target_closure.type != Type.CLOSURE:
-            super().error(ErrorType.TYPE_ERROR, f"Function {mfunc_objref}.{mfunc_name} is changed to non-function type.")
+    # the scopes of the running function merged into one, innermost first
+    def __merge_frame(self):
+        merged_env = {}
+        for env in reversed(self.env.environment[self.frame_base:]):
+            for var_name, cell in env.items():
+                if var_name not in merged_env:
+                    merged_env[var_name] = cell
+        return merged_env
+
+    # resolves the method, and evaluates the arguments into a new environment
+    def __prepare_mcall(self, call_ast):
+        call_site, args = self.__call_site(call_ast)
+        target_closure = self.resolve_call(call_site)
+        target_ast = target_closure.func_ast
 
+        new_env = {}
+        if target_closure.captured_env:
+            self.prepare_env_with_closed_variables(target_closure, new_env)
+        self.__prepare_params(target_ast, args, new_env)
+        self.bind_this(call_site.mfunc_objref, new_env)
+        return target_ast, new_env
+
+    def __prepare_fcall(self, call_ast):
+        call_site, args = self.__call_site(call_ast)
+        target_closure = self.resolve_call(call_site)
         target_ast = target_closure.func_ast
 
         new_env = {}
-        self.__prepare_env_with_closed_variables(target_closure, new_env)
-        self.__prepare_params(target_ast, call_ast, new_env)
-        if self.env.get('this') == None:
-            new_env['this'] = self.env.get(mfunc_objref)
-        elif self.env.get('this') != mfunc_objref:
-            new_env['this'] = self.env.get(mfunc_objref)
-        elif self.env.get('this') == mfunc_objref:
-            new_env['this'] = self.env.get('this')
-        self.env.push(new_env)
+        if target_closure.captured_env:
+            self.prepare_env_with_closed_variables(target_closure, new_env)
+        self.__prepare_params(target_ast, args, new_env)
+        return target_ast, new_env
+
+    # returns the CallSite of a call and its arguments, each as (ast, var,
+    # field) with var and field set when the argument is a variable
+    def __call_site(self, call_ast):
+        prepared = self.call_sites.get(call_ast)
+        if prepared is None:
+            args = []
+            for actual_ast in call_ast.get("args"):
+                if actual_ast.elem_type == InterpreterBase.VAR_DEF:
+                    args.append((actual_ast,) + self.split_var_name(actual_ast.get("name")))
+                else:
+                    args.append((actual_ast, None, None))
+            call_site = CallSite(call_ast.get("name"), len(args), call_ast.get("objref"))
+            prepared = (call_site, tuple(args))
+            self.call_sites[call_ast] = prepared
+        return prepared
 
-        _, return_val = self.__run_statements(target_ast.get("statements"))
-        self.env.pop()
-        return return_val
+    def __call_mfunc(self, call_ast):
+        return self.__run_function(*self.__prepare_mcall(call_ast))
     
     
     def __call_func(self, call_ast):
         func_name = call_ast.get("name")
         if func_name == "print":
             return self.__call_print(call_ast)
-        if func_name == "inputi":
+        if func_name == "inputi" or func_name == "inputs":
             return self.__call_input(call_ast)
 
-        actual_args = call_ast.get("args")
-        target_closure = self.__get_func_by_name(func_name, len(actual_args))
-        if target_closure == None:
-            super().error(ErrorType.NAME_ERROR, f"Function {func_name} not found")
-        if target_closure.type != Type.CLOSURE:
-            super().error(ErrorType.TYPE_ERROR, f"Function {func_name} is changed to non-function type.")
-        target_ast = target_closure.func_ast
-
-        new_env = {}
-        self.__prepare_env_with_closed_variables(target_closure, new_env)
-        self.__prepare_params(target_ast,call_ast, new_env)
-        self.env.push(new_env)
-
-        _, return_val = self.__run_statements(target_ast.get("statements"))
-        self.env.pop()
-        return return_val
-
-    def __prepare_env_with_closed_variables(self, target_closure, temp_env):
-        for var_name, value in target_closure.captured_env:
-            # Updated here - ignore updates to the scope if we
-            #   altered a parameter, or if the argument is a similarly named variable
-            if value.type() == Type.CLOSURE or value.type() == Type.OBJECT:
-                temp_env[var_name] = self.env.get(var_name)
-                continue
-            temp_env[var_name] = value
-                    # print(symbol)
-                    # print(self.env.get(symbol).v.objectEnv)
-
-
-    def __prepare_params(self, target_ast, call_ast, temp_env):
-        actual_args = call_ast.get("args")
-        formal_args = target_ast.get("args")
-        if len(actual_args) != len(formal_args):
+        return self.__run_function(*self.__prepare_fcall(call_ast))
+
+    # args is the call's arguments as returned by __call_site
+    def __prepare_params(self, target_ast, args, temp_env):
+        params = self.param_plans.get(target_ast)
+        if params is None:
+            params = tuple(
+                (
+                    formal_ast.get("name"),
+                    formal_ast.elem_type == InterpreterBase.REFARG_DEF
+                    or formal_ast.elem_type == InterpreterBase.OBJ_DEF,
+                )
+                for formal_ast in target_ast.get("args")
+            )
+            self.param_plans[target_ast] = params
+        if len(args) != len(params):
             super().error(
                 ErrorType.NAME_ERROR,
-                f"Function {target_ast.get('name')} with {len(actual_args)} args not found",
+                f"Function {target_ast.get('name')} with {len(args)} args not found",
             )
 
         # foo(formal_ast) {} foo(actual_ast)
-        for formal_ast, actual_ast in zip(formal_args, actual_args):
-            if formal_ast.elem_type == InterpreterBase.REFARG_DEF or formal_ast.elem_type == InterpreterBase.OBJ_DEF:
-                result = self.__eval_expr(actual_ast)
-
+        for (arg_name, by_ref), (actual_ast, var_name, object_var_name) in zip(params, args):
+            if not by_ref:
+                temp_env[arg_name] = Cell(copy_value(self.__eval_expr(actual_ast)))
+            elif var_name is not None:
+                # a variable is passed as its Cell, anything else gets a new one
+                temp_env[arg_name] = self.lookup_cell(var_name, object_var_name)
             else:
-                result = copy.deepcopy(self.__eval_expr(actual_ast))
-
-            arg_name = formal_ast.get("name")
-            temp_env[arg_name] = result
+                temp_env[arg_name] = Cell(self.__eval_expr(actual_ast))
 
     def __call_print(self, call_ast):
-        output = ""
+        output = []
         for arg in call_ast.get("args"):
             result = self.__eval_expr(arg)  # result is a Value object
-            output = output + get_printable(result)
-        super().output(output)
+            output.append(printable_arg(result))
+        super().output("".join(output))
         return Interpreter.NIL_VALUE
 
     def __call_input(self, call_ast):
@@ -221,68 +624,30 @@ class Interpreter(InterpreterBase):
             super().output(get_printable(result))
         elif args is not None and len(args) > 1:
             super().error(
-                ErrorType.NAME_ERROR, "No inputi() function that takes > 1 parameter"
+                ErrorType.NAME_ERROR, f"No {call_ast.get('name')}() function that takes > 1 parameter"
             )
         inp = super().get_input()
         if call_ast.get("name") == "inputi":
-            return Value(Type.INT, int(inp))
+            return self.make_int(int(inp))
         if call_ast.get("name") == "inputs":
+            if self.unboxed:
+                return inp
             return Value(Type.STRING, inp)
 
-    def __split_var_name(self, var_name):
-        parts = var_name.split('.')
-        if len(parts) == 2:
-            return parts[0], parts[1]
-        elif len(parts) == 1:
-            return parts[0], None
-        else:
-            return None, None
-
     def __assign(self, assign_ast):
-        var_name, object_var_name = self.__split_var_name(assign_ast.get("name"))
-        src_value_obj = copy.copy(self.__eval_expr(assign_ast.get("expression")))
-        target_value_obj = self.env.get(var_name)
-        if target_value_obj is None:
-            if object_var_name is not None:
-                super().error(
-                    ErrorType.NAME_ERROR,
-                    f"Object {var_name} does not exist"
-                )
-            self.env.set(var_name, src_value_obj)
-
-        else:
-            # if a close is changed to another type such as int, we cannot make function calls on it any more 
-            if target_value_obj.t == Type.CLOSURE and src_value_obj.t != Type.CLOSURE:
-                target_value_obj.v.type = src_value_obj.t
-            if target_value_obj.t == Type.OBJECT:
-                if object_var_name == "proto":
-                    if not (src_value_obj.type() is Type.OBJECT or src_value_obj.type() is Type.NIL):
-                        super().error(ErrorType.TYPE_ERROR, f"You cannot have a prototype of non-object type")
-                    if src_value_obj.type() is Type.NIL:
-                        target_value_obj.v.setProto(None)
-                    else:
-                        target_value_obj.v.setProto(src_value_obj)
-                elif object_var_name is None:
-                    target_value_obj.set(src_value_obj)
-                else:
-                    target_value_obj.v.addOrUpdate(object_var_name, src_value_obj)
-            elif object_var_name is not None:
-                super().error(
-                    ErrorType.TYPE_ERROR,
-                    f"{var_name} is of non-object type"
-                )
-            else:
-                target_value_obj.set(src_value_obj)
+        var_name, object_var_name = self.split_var_name(assign_ast.get("name"))
+        src_value_obj = self.__eval_expr(assign_ast.get("expression"))
+        self.assign_value(var_name, object_var_name, src_value_obj)
 
     def __eval_expr(self, expr_ast):
         if expr_ast.elem_type == InterpreterBase.NIL_DEF:
             return Interpreter.NIL_VALUE
         if expr_ast.elem_type == InterpreterBase.INT_DEF:
-            return Value(Type.INT, expr_ast.get("val"))
+            return self.make_int(expr_ast.get("val"))
         if expr_ast.elem_type == InterpreterBase.STRING_DEF:
-            return Value(Type.STRING, expr_ast.get("val"))
+            return self.make_string(expr_ast.get("val"))
         if expr_ast.elem_type == InterpreterBase.BOOL_DEF:
-            return Value(Type.BOOL, expr_ast.get("val"))
+            return self.make_bool(expr_ast.get("val"))
         if expr_ast.elem_type == InterpreterBase.VAR_DEF:
             return self.__eval_name(expr_ast)
         if expr_ast.elem_type == InterpreterBase.MCALL_DEF:
@@ -301,62 +666,47 @@ class Interpreter(InterpreterBase):
             return Value(Type.OBJECT, Object())
 
     def __eval_name(self, name_ast):
-        var_name, object_var_name = self.__split_var_name(name_ast.get("name"))
-        
-        val = self.env.get(var_name)
-        if val is not None:
-            if object_var_name is not None and val.t is not Type.OBJECT:
-                super().error(
-                    ErrorType.TYPE_ERROR, f"Object {var_name} is of non-object type"
-                )
-            if val.t is Type.OBJECT:
-                if object_var_name is None:
-                    return val
-
-                if object_var_name == "proto":
-                    val = val.value().getProto()
-                else:
-                    val = val.value().getObj(object_var_name)
-
-                if val is None:
-                    super().error(
-                        ErrorType.NAME_ERROR, f"Variable/function {var_name}.{object_var_name} not found"
-                    )
-                
-            return val
-            
-        closure = self.__get_func_by_name(var_name, None)
-        if closure is None:
-            super().error(
-                ErrorType.NAME_ERROR, f"Variable/function {var_name} not found"
-            )
-        
-        return Value(Type.CLOSURE, closure)
-    
-
+        var_name, object_var_name = self.split_var_name(name_ast.get("name"))
+        if object_var_name is None:
+            val = self.env.get(var_name)
+            if val is not None:
+                return val
+        elif object_var_name != "proto":
+            field_cache = self.field_caches.get(name_ast)
+            if field_cache is None:
+                field_cache = FieldCache(object_var_name)
+                self.field_caches[name_ast] = field_cache
+            return self.lookup_field(var_name, field_cache)
+        return self.lookup_name(var_name, object_var_name)
+
+    # the first time an operator node runs it is specialised for the types
+    # of its operands; later runs with the same types skip the promotion and
+    # type checks of eval_bin_op
     def __eval_op(self, arith_ast):
         left_value_obj = self.__eval_expr(arith_ast.get("op1"))
         right_value_obj = self.__eval_expr(arith_ast.get("op2"))
-
-
-        left_value_obj, right_value_obj = self.__bin_op_promotion(
-            arith_ast.elem_type, left_value_obj, right_value_obj
-        )
-
-        if not self.__compatible_types(
-            arith_ast.elem_type, left_value_obj, right_value_obj
-        ):
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible types for {arith_ast.elem_type} operation",
-            )
-        if arith_ast.elem_type not in self.op_to_lambda[left_value_obj.type()]:
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible operator {arith_ast.elem_type} for type {left_value_obj.type()}",
-            )
-        f = self.op_to_lambda[left_value_obj.type()][arith_ast.elem_type]
-        return f(left_value_obj, right_value_obj)
+        quickened = self.quickened_ops.get(arith_ast)
+        if quickened is None:
+            quickened = quicken_op(arith_ast.elem_type, left_value_obj, right_value_obj)
+            self.quickened_ops[arith_ast] = quickened
+        operand_type, make_result, f = quickened
+        if left_value_obj.t is operand_type and right_value_obj.t is operand_type:
+            return make_result(f(left_value_obj.v, right_value_obj.v))
+        return self.eval_bin_op(arith_ast.elem_type, left_value_obj, right_value_obj)
+
+    # __eval_op for unboxed values, whose promotions and errors are left to
+    # eval_bin_op on their Values
+    def __eval_unboxed_op(self, arith_ast):
+        left = self.__eval_expr(arith_ast.get("op1"))
+        right = self.__eval_expr(arith_ast.get("op2"))
+        quickened = self.quickened_ops.get(arith_ast)
+        if quickened is None:
+            quickened = quicken_unboxed_op(arith_ast.elem_type, left, right)
+            self.quickened_ops[arith_ast] = quickened
+        operand_type, f = quickened
+        if left.__class__ is operand_type and right.__class__ is operand_type:
+            return f(left, right)
+        return unbox(self.eval_bin_op(arith_ast.elem_type, box(left), box(right)))
 
     # bool and int, int and bool for and/or/==/!= -> coerce int to bool
     # bool and int, int and bool for arithmetic ops, coerce true to 1, false to 0
@@ -386,11 +736,11 @@ class Interpreter(InterpreterBase):
 
     @staticmethod
     def __int_to_bool(value):
-        return Value(Type.BOOL, value.value() != 0)
+        return bool_value(value.value() != 0)
 
     @staticmethod
     def __bool_to_int(value):
-        return Value(Type.INT, 1 if value.value() else 0)
+        return int_value(1 if value.value() else 0)
 
     def __compatible_types(self, oper, obj1, obj2):
         # DOCUMENT: allow comparisons ==/!= of anything against anything
@@ -400,114 +750,113 @@ class Interpreter(InterpreterBase):
 
     def __eval_unary(self, arith_ast, t, f):
         value_obj = self.__eval_expr(arith_ast.get("op1"))
-        value_obj = self.__unary_op_promotion(arith_ast.elem_type, value_obj)
-
-        if value_obj.type() != t:
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible type for {arith_ast.elem_type} operation",
-            )
-        return Value(t, f(value_obj.value()))
+        if value_obj.t is t:
+            if t is Type.INT:
+                return int_value(f(value_obj.v))
+            return bool_value(f(value_obj.v))
+        return self.eval_unary_op(arith_ast.elem_type, t, f, value_obj)
+
+    def __eval_unboxed_unary(self, arith_ast, t, f):
+        value = self.__eval_expr(arith_ast.get("op1"))
+        if PYTHON_TYPES.get(value.__class__) is t:
+            return f(value)
+        return unbox(self.eval_unary_op(arith_ast.elem_type, t, f, box(value)))
+
+    def __eval_unboxed_condition(self, result, kind):
+        if result.__class__ is bool:
+            return result
+        return Interpreter.eval_condition(self, box(result), kind)
 
     def __setup_ops(self):
         self.op_to_lambda = {}
         # set up operations on integers
         self.op_to_lambda[Type.INT] = {}
-        self.op_to_lambda[Type.INT]["+"] = lambda x, y: Value(
-            x.type(), x.value() + y.value()
+        self.op_to_lambda[Type.INT]["+"] = lambda x, y: int_value(
+            x.value() + y.value()
         )
-        self.op_to_lambda[Type.INT]["-"] = lambda x, y: Value(
-            x.type(), x.value() - y.value()
+        self.op_to_lambda[Type.INT]["-"] = lambda x, y: int_value(
+            x.value() - y.value()
         )
-        self.op_to_lambda[Type.INT]["*"] = lambda x, y: Value(
-            x.type(), x.value() * y.value()
+        self.op_to_lambda[Type.INT]["*"] = lambda x, y: int_value(
+            x.value() * y.value()
         )
-        self.op_to_lambda[Type.INT]["/"] = lambda x, y: Value(
-            x.type(), x.value() // y.value()
+        self.op_to_lambda[Type.INT]["/"] = lambda x, y: int_value(
+            x.value() // y.value()
         )
-        self.op_to_lambda[Type.INT]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
+        self.op_to_lambda[Type.INT]["=="] = lambda x, y: bool_value(
+            x.value() == y.value()
         )
-        self.op_to_lambda[Type.INT]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
+        self.op_to_lambda[Type.INT]["!="] = lambda x, y: bool_value(
+            x.value() != y.value()
         )
-        self.op_to_lambda[Type.INT]["<"] = lambda x, y: Value(
-            Type.BOOL, x.value() < y.value()
+        self.op_to_lambda[Type.INT]["<"] = lambda x, y: bool_value(
+            x.value() < y.value()
         )
-        self.op_to_lambda[Type.INT]["<="] = lambda x, y: Value(
-            Type.BOOL, x.value() <= y.value()
+        self.op_to_lambda[Type.INT]["<="] = lambda x, y: bool_value(
+            x.value() <= y.value()
         )
-        self.op_to_lambda[Type.INT][">"] = lambda x, y: Value(
-            Type.BOOL, x.value() > y.value()
+        self.op_to_lambda[Type.INT][">"] = lambda x, y: bool_value(
+            x.value() > y.value()
         )
-        self.op_to_lambda[Type.INT][">="] = lambda x, y: Value(
-            Type.BOOL, x.value() >= y.value()
+        self.op_to_lambda[Type.INT][">="] = lambda x, y: bool_value(
+            x.value() >= y.value()
         )
         #  set up operations on strings
         self.op_to_lambda[Type.STRING] = {}
-        self.op_to_lambda[Type.STRING]["+"] = lambda x, y: Value(
-            x.type(), x.value() + y.value()
+        self.op_to_lambda[Type.STRING]["+"] = concat_strings
+        self.op_to_lambda[Type.STRING]["=="] = lambda x, y: bool_value(
+            x.value() == y.value()
         )
-        self.op_to_lambda[Type.STRING]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
-        )
-        self.op_to_lambda[Type.STRING]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
+        self.op_to_lambda[Type.STRING]["!="] = lambda x, y: bool_value(
+            x.value() != y.value()
         )
         #  set up operations on bools
         self.op_to_lambda[Type.BOOL] = {}
-        self.op_to_lambda[Type.BOOL]["&&"] = lambda x, y: Value(
-            x.type(), x.value() and y.value()
+        self.op_to_lambda[Type.BOOL]["&&"] = lambda x, y: bool_value(
+            x.value() and y.value()
         )
-        self.op_to_lambda[Type.BOOL]["||"] = lambda x, y: Value(
-            x.type(), x.value() or y.value()
+        self.op_to_lambda[Type.BOOL]["||"] = lambda x, y: bool_value(
+            x.value() or y.value()
         )
-        self.op_to_lambda[Type.BOOL]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
+        self.op_to_lambda[Type.BOOL]["=="] = lambda x, y: bool_value(
+            x.value() == y.value()
         )
-        self.op_to_lambda[Type.BOOL]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
+        self.op_to_lambda[Type.BOOL]["!="] = lambda x, y: bool_value(
+            x.value() != y.value()
         )
 
         #  set up operations on nil
         self.op_to_lambda[Type.NIL] = {}
-        self.op_to_lambda[Type.NIL]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
+        self.op_to_lambda[Type.NIL]["=="] = lambda x, y: bool_value(
+            x.value() == y.value()
         )
-        self.op_to_lambda[Type.NIL]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
+        self.op_to_lambda[Type.NIL]["!="] = lambda x, y: bool_value(
+            x.value() != y.value()
         )
 
         #  set up operations on closures
         self.op_to_lambda[Type.CLOSURE] = {}
-        self.op_to_lambda[Type.CLOSURE]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
+        self.op_to_lambda[Type.CLOSURE]["=="] = lambda x, y: bool_value(
+            x.value() == y.value()
         )
-        self.op_to_lambda[Type.CLOSURE]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
+        self.op_to_lambda[Type.CLOSURE]["!="] = lambda x, y: bool_value(
+            x.value() != y.value()
         )
 
 
         self.op_to_lambda[Type.OBJECT] = {}
-        self.op_to_lambda[Type.OBJECT]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
+        self.op_to_lambda[Type.OBJECT]["=="] = lambda x, y: bool_value(
+            x.value() == y.value()
         )
-        self.op_to_lambda[Type.OBJECT]["!="] = lambda x, y: Value(
+        self.op_to_lambda[Type.OBJECT]["!="] = lambda x, y: bool_value(
 
-            Type.BOOL, x.value() != y.value()  
+            x.value() != y.value()  
         )
 
     def __do_if(self, if_ast):
         cond_ast = if_ast.get("condition")
         result = self.__eval_expr(cond_ast)
-        if result.type() == Type.INT:
-            result = Interpreter.__int_to_bool(result)
-        if result.type() != Type.BOOL:
-            super().error(
-                ErrorType.TYPE_ERROR,
-                "Incompatible type for if condition",
-            )
-        if result.value():
+        if self.eval_condition(result, "if"):
             statements = if_ast.get("statements")
             status, return_val = self.__run_statements(statements)
             return (status, return_val)
@@ -521,29 +870,28 @@ class Interpreter(InterpreterBase):
 
     def __do_while(self, while_ast):
         cond_ast = while_ast.get("condition")
-        run_while = Interpreter.TRUE_VALUE
-        while run_while.value():
-            run_while = self.__eval_expr(cond_ast)
-            if run_while.type() == Type.INT:
-                run_while = Interpreter.__int_to_bool(run_while)
-            if run_while.type() != Type.BOOL:
-                super().error(
-                    ErrorType.TYPE_ERROR,
-                    "Incompatible type for while condition",
-                )
-            if run_while.value():
-                statements = while_ast.get("statements")
-                status, return_val = self.__run_statements(statements)
-                if status == ExecStatus.RETURN:
-                    return status, return_val
+        while self.eval_condition(self.__eval_expr(cond_ast), "while"):
+            statements = while_ast.get("statements")
+            status, return_val = self.__run_statements(statements)
+            if status != ExecStatus.CONTINUE:
+                return status, return_val
 
         return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
 
+    # return f(...) and return o.m(...) are tail calls: the call is prepared
+    # here, in the caller's scope, and made by __run_function once the
+    # caller's scopes are gone
     def __do_return(self, return_ast):
         expr_ast = return_ast.get("expression")
         if expr_ast is None:
             return (ExecStatus.RETURN, Interpreter.NIL_VALUE)
-        value_obj = copy.deepcopy(self.__eval_expr(expr_ast))
+        if expr_ast.elem_type == InterpreterBase.MCALL_DEF:
+            target_ast, new_env = self.__prepare_mcall(expr_ast)
+            return (ExecStatus.TAIL_CALL, (target_ast, self.__merge_frame(), new_env))
+        if expr_ast.elem_type == InterpreterBase.FCALL_DEF and expr_ast.get("name") not in ("print", "inputi", "inputs"):
+            target_ast, new_env = self.__prepare_fcall(expr_ast)
+            return (ExecStatus.TAIL_CALL, (target_ast, self.__merge_frame(), new_env))
+        value_obj = copy_value(self.__eval_expr(expr_ast))
         return (ExecStatus.RETURN, value_obj)
 
 # FOR TESTING PURPOSES
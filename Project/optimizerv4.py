@@ -0,0 +1,203 @@
+from element import Element
+from intbase import InterpreterBase
+from type_valuev4 import Type, Value
+
+LITERAL_TYPES = {
+    InterpreterBase.INT_DEF: Type.INT,
+    InterpreterBase.STRING_DEF: Type.STRING,
+    InterpreterBase.BOOL_DEF: Type.BOOL,
+}
+
+
+# Rewrites the ast returned by parse_program before it is run:
+#  - operators whose operands are all literals are replaced by their result,
+#    computed by the interpreter's own eval_bin_op/eval_unary_op so coercions
+#    are identical; expressions that would fail are left for the run to report
+#  - ifs and whiles with a literal condition are pruned
+#  - statements that are never executed are dropped (expression statements
+#    other than calls, and anything after a return in the same block)
+# The parsed tree is left untouched; a new one is returned.
+def optimize_program(ast):
+    global _optimizer
+    if _optimizer is None:
+        # imported here as interpreterv4 depends on this module
+        from interpreterv4 import Interpreter
+
+        _optimizer = Optimizer(Interpreter(console_output=False))
+    return _optimizer.optimize(ast)
+
+
+# the Optimizer every program is optimized by, made on first use; its
+# interpreter only ever evaluates operators on literals
+_optimizer = None
+
+
+class Optimizer:
+    def __init__(self, evaluator):
+        self.evaluator = evaluator  # only used to evaluate operators
+
+    def optimize(self, ast):
+        return self.__rebuild(ast)
+
+    # copies node, optimizing every statement list and expression under it
+    def __rebuild(self, node):
+        fields = {}
+        for key, value in node.items():
+            if key in ("statements", "else_statements") and value is not None:
+                value = self.__optimize_statements(value)
+            elif isinstance(value, Element):
+                value = self.__optimize_expr(value)
+            elif isinstance(value, list):
+                value = [self.__optimize_expr(item) for item in value]
+            fields[key] = value
+        return Element(node.elem_type, **fields)
+
+    def __optimize_statements(self, statements):
+        optimized = []
+        for statement in statements:
+            optimized.extend(self.__optimize_statement(statement))
+            if optimized and optimized[-1].elem_type == InterpreterBase.RETURN_DEF:
+                break
+        return optimized
+
+    # returns the list of statements that replace statement
+    def __optimize_statement(self, statement):
+        kind = statement.elem_type
+        if kind == InterpreterBase.IF_DEF:
+            return self.__optimize_if(self.__rebuild(statement))
+        if kind == InterpreterBase.WHILE_DEF:
+            statement = self.__rebuild(statement)
+            if self.__constant_condition(statement.get("condition")) is False:
+                return []
+            return [statement]
+        if kind in (
+            "=",
+            InterpreterBase.RETURN_DEF,
+            InterpreterBase.FCALL_DEF,
+            InterpreterBase.MCALL_DEF,
+        ):
+            return [self.__rebuild(statement)]
+        # the interpreter never evaluates any other kind of statement
+        return []
+
+    def __optimize_if(self, if_ast):
+        taken = self.__constant_condition(if_ast.get("condition"))
+        if taken is None:
+            return [if_ast]
+        if taken:
+            statements = if_ast.get("statements")
+        else:
+            statements = if_ast.get("else_statements")
+            if statements is None:
+                return []
+        # the taken branch can only be spliced into the enclosing block when
+        # it can't create a variable in its own scope
+        if not may_create_variable(statements):
+            return statements
+        return [
+            Element(
+                InterpreterBase.IF_DEF,
+                condition=Element(InterpreterBase.BOOL_DEF, val=True),
+                statements=statements,
+                else_statements=None,
+            )
+        ]
+
+    # returns True/False for a literal if/while condition, None otherwise
+    def __constant_condition(self, cond_ast):
+        value_obj = self.__constant(cond_ast)
+        if value_obj is None:
+            return None
+        if value_obj.type() == Type.INT:
+            return value_obj.value() != 0
+        if value_obj.type() == Type.BOOL:
+            return value_obj.value()
+        return None
+
+    def __optimize_expr(self, expr_ast):
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.FUNC_DEF or kind == InterpreterBase.LAMBDA_DEF:
+            return self.__rebuild(expr_ast)
+        if kind in self.evaluator.BIN_OPS:
+            expr_ast = self.__rebuild(expr_ast)
+            op1 = self.__constant(expr_ast.get("op1"))
+            op2 = self.__constant(expr_ast.get("op2"))
+            if op1 is None or op2 is None:
+                return expr_ast
+            return self.__fold(
+                expr_ast, lambda: self.evaluator.eval_bin_op(kind, op1, op2)
+            )
+        if kind == InterpreterBase.NEG_DEF or kind == InterpreterBase.NOT_DEF:
+            expr_ast = self.__rebuild(expr_ast)
+            op1 = self.__constant(expr_ast.get("op1"))
+            if op1 is None:
+                return expr_ast
+            if kind == InterpreterBase.NEG_DEF:
+                return self.__fold(
+                    expr_ast,
+                    lambda: self.evaluator.eval_unary_op(kind, Type.INT, lambda x: -1 * x, op1),
+                )
+            return self.__fold(
+                expr_ast,
+                lambda: self.evaluator.eval_unary_op(kind, Type.BOOL, lambda x: not x, op1),
+            )
+        if kind in (InterpreterBase.FCALL_DEF, InterpreterBase.MCALL_DEF):
+            return self.__rebuild(expr_ast)
+        return expr_ast
+
+    # replaces expr_ast with a literal for its value, unless evaluating it
+    # fails, in which case the error is left to happen at run time
+    def __fold(self, expr_ast, evaluate):
+        try:
+            value_obj = evaluate()
+        except Exception:
+            return expr_ast
+        if value_obj.type() == Type.NIL:
+            return Element(InterpreterBase.NIL_DEF)
+        for kind, t in LITERAL_TYPES.items():
+            if value_obj.type() == t:
+                return Element(kind, val=value_obj.value())
+        return expr_ast
+
+    # returns the Value of a literal node, None for anything else
+    def __constant(self, expr_ast):
+        if expr_ast.elem_type == InterpreterBase.NIL_DEF:
+            return Value(Type.NIL, None)
+        if expr_ast.elem_type in LITERAL_TYPES:
+            return Value(LITERAL_TYPES[expr_ast.elem_type], expr_ast.get("val"))
+        return None
+
+
+# whether running a block can create a variable in the block's own scope:
+# only assigning to a plain name that isn't found anywhere does, and blocks
+# nested in it get scopes of their own
+def may_create_variable(statements):
+    for statement in statements:
+        if statement.elem_type == "=" and "." not in statement.get("name"):
+            return True
+    return False
+
+
+# returns an indented, one node per line listing of an ast
+def dump_ast(node, indent=0):
+    pad = "  " * indent
+    scalars = []
+    children = []
+    for key, value in node.items():
+        if isinstance(value, Element) or (isinstance(value, list) and value):
+            children.append((key, value))
+        elif isinstance(value, list):
+            scalars.append(f"{key}: []")
+        else:
+            scalars.append(f"{key}: {value!r}")
+    lines = [pad + " ".join([node.elem_type] + scalars)]
+    for key, value in children:
+        lines.append(f"{pad}  {key}:")
+        if isinstance(value, Element):
+            value = [value]
+        for item in value:
+            if isinstance(item, Element):
+                lines.append(dump_ast(item, indent + 2))
+            else:
+                lines.append(f"{pad}    {item}")
+    return "\n".join(lines)
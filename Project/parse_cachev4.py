@@ -0,0 +1,165 @@
+import gc
+import hashlib
+import marshal
+import os
+import tempfile
+
+import brewdescent
+import brewlex
+import brewparse
+import brewscan
+from brewparse import parse_program
+from element import Element
+
+# bumped whenever the way trees are encoded below changes
+FORMAT_VERSION = 1
+
+
+# hashes what a cached tree depends on besides the program: the tokens and
+# their scanner, the grammar with its actions and the parser that can be
+# used instead of it, the encoding and the python version's marshal
+def _grammar_signature():
+    signature = hashlib.sha256()
+    for module in (brewlex, brewscan, brewparse, brewdescent):
+        with open(module.__file__, "rb") as file:
+            signature.update(file.read())
+    signature.update(f"{FORMAT_VERSION} {marshal.version}".encode())
+    return signature.digest()
+
+
+# An Element is encoded as the tuple (elem_type, key, value, key, value, ...)
+# and its lists of Elements as lists, so the whole tree is made of values
+# marshal can store; nothing else the parser produces is a tuple or a list,
+# and lists hold nothing but Elements.
+def _encode(value):
+    if isinstance(value, Element):
+        encoded = [value.elem_type]
+        for key, field in value.items():
+            encoded.append(key)
+            encoded.append(_encode(field))
+        return tuple(encoded)
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _decode(node):
+    fields = {}
+    for i in range(1, len(node), 2):
+        value = node[i + 1]
+        if value.__class__ is tuple:
+            value = _decode(value)
+        elif value.__class__ is list:
+            value = [_decode(item) for item in value]
+        fields[node[i]] = value
+    return Element(node[0], **fields)
+
+
+# the tree has no cycles, so the collector only slows building it down
+def _load(data):
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _decode(marshal.loads(data))
+    finally:
+        if enabled:
+            gc.enable()
+
+
+# A parse_program that keeps the trees it parses in files in directory, named
+# by a hash of the program and the grammar, so a program parsed by any
+# process using the same directory is only read back afterwards. Files are
+# written whole under a temporary name and then renamed, so processes never
+# see a partial one; once the directory holds more than max_bytes of them,
+# the least recently used ones are removed (their modification time is
+# updated whenever they are read). A file that can't be read for any reason,
+# e.g. because another process has just removed it, is parsed again.
+class ParseCache:
+    SUFFIX = ".ast"
+
+    def __init__(self, directory, max_bytes=64 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.signature = _grammar_signature()
+        os.makedirs(directory, exist_ok=True)
+
+    # caches in the same directory are interchangeable, which lets
+    # get_compiled_program keep one compiled program for all of them
+    def __eq__(self, other):
+        return isinstance(other, ParseCache) and self.__key() == other.__key()
+
+    def __hash__(self):
+        return hash(self.__key())
+
+    def __key(self):
+        return (os.path.abspath(self.directory), self.max_bytes)
+
+    # parser is only used for programs that aren't in the cache, as both
+    # parsers build the same trees
+    def parse(self, program, parser="lalr"):
+        path = self.__path(program)
+        ast = self.__read(path)
+        if ast is None:
+            ast = parse_program(program, parser)
+            self.__write(path, ast)
+        return ast
+
+    def __path(self, program):
+        key = hashlib.sha256(self.signature + program.encode()).hexdigest()
+        return os.path.join(self.directory, key + ParseCache.SUFFIX)
+
+    def __read(self, path):
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+            ast = _load(data)
+            os.utime(path)
+        except (OSError, EOFError, ValueError, TypeError, IndexError, RecursionError):
+            return None
+        return ast
+
+    # a tree nested too deeply for _encode's recursion or for marshal just
+    # isn't cached, like one that can't be written
+    def __write(self, path, ast):
+        try:
+            data = marshal.dumps(_encode(ast))
+        except (ValueError, RecursionError):
+            return
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    file.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            self.__evict()
+        except OSError:
+            pass  # the tree just isn't cached
+
+    # removes the least recently used files until the rest fit in max_bytes
+    def __evict(self):
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if not entry.name.endswith(ParseCache.SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+            if total <= self.max_bytes:
+                break
@@ -0,0 +1,544 @@
+import ast as pyast
+import functools
+
+from brewparse import parse_program
+from intbase import InterpreterBase, ErrorType
+from optimizerv4 import may_create_variable, optimize_program
+from type_valuev4 import (
+    FALSE,
+    TRUE,
+    CallSite,
+    Cell,
+    Object,
+    Closure,
+    FieldCache,
+    Type,
+    Value,
+    copy_value,
+    get_printable,
+    int_value,
+    literal_value,
+    printable_arg,
+)
+
+
+# python operators used when both operands of a brewin operator are ints
+ARITH_OPS = {
+    "+": pyast.Add,
+    "-": pyast.Sub,
+    "*": pyast.Mult,
+    "/": pyast.FloorDiv,
+}
+COMPARE_OPS = {
+    "==": pyast.Eq,
+    "!=": pyast.NotEq,
+    "<": pyast.Lt,
+    "<=": pyast.LtE,
+    ">": pyast.Gt,
+    ">=": pyast.GtE,
+}
+
+# names every generated module can refer to as globals
+MODULE_GLOBALS = {
+    "Value": Value,
+    "Closure": Closure,
+    "Object": Object,
+    "copy_value": copy_value,
+    "int_value": int_value,
+    "TRUE": TRUE,
+    "FALSE": FALSE,
+    "INT": Type.INT,
+    "BOOL": Type.BOOL,
+    "STRING": Type.STRING,
+    "CLOSURE": Type.CLOSURE,
+    "OBJECT": Type.OBJECT,
+    "NEG": lambda x: -1 * x,
+    "NOT": lambda x: not x,
+}
+
+
+def _load(name):
+    return pyast.Name(id=name, ctx=pyast.Load())
+
+
+def _store(name):
+    return pyast.Name(id=name, ctx=pyast.Store())
+
+
+def _const(value):
+    return pyast.Constant(value=value)
+
+
+def _call(func_name, *args):
+    return pyast.Call(func=_load(func_name), args=list(args), keywords=[])
+
+
+def _attr(value, attr):
+    return pyast.Attribute(value=value, attr=attr, ctx=pyast.Load())
+
+
+def _walrus(name, value):
+    return pyast.NamedExpr(target=_store(name), value=value)
+
+
+def _is(left, right):
+    return pyast.Compare(left=left, ops=[pyast.Is()], comparators=[right])
+
+
+# Translates every func and lambda of a program into a python function
+# def fN(rt), where rt is the PythonRuntime of the current run. Each
+# function body is turned into python statements, and variables are read
+# and written through the interpreter's environment so dynamic scoping works
+# as before. Int arithmetic and comparisons are emitted as python operators
+# guarded by a type check, everything else calls back into the runtime.
+class PythonCompiler:
+    def __init__(self, trace_output=False):
+        self.trace_output = trace_output
+
+    # returns the python module for all the functions of the program
+    def translate_program(self, ast):
+        self.consts = []
+        self.func_names = {}
+        self.pending = list(ast.get("functions"))
+        defs = []
+        while self.pending:
+            func_ast = self.pending.pop(0)
+            defs.append(self.__compile_function(func_ast))
+        return pyast.fix_missing_locations(pyast.Module(body=defs, type_ignores=[]))
+
+    # returns {func/lambda ast: (params, python function)}
+    def compile_program(self, ast):
+        module = self.translate_program(ast)
+        namespace = dict(MODULE_GLOBALS)
+        namespace["CONSTS"] = self.consts
+        exec(compile(module, "<brewin>", "exec"), namespace)
+        functions = {}
+        for func_ast, func_name in self.func_names.items():
+            params = tuple(
+                (
+                    formal_ast.get("name"),
+                    formal_ast.elem_type == InterpreterBase.REFARG_DEF
+                    or formal_ast.elem_type == InterpreterBase.OBJ_DEF,
+                )
+                for formal_ast in func_ast.get("args")
+            )
+            functions[func_ast] = (params, namespace[func_name])
+        return functions
+
+    def __func_name(self, func_ast):
+        if func_ast not in self.func_names:
+            self.func_names[func_ast] = f"f{len(self.func_names)}"
+        return self.func_names[func_ast]
+
+    def __add_const(self, const):
+        self.consts.append(const)
+        return pyast.Subscript(
+            value=_load("CONSTS"), slice=_const(len(self.consts) - 1), ctx=pyast.Load()
+        )
+
+    def __temp(self):
+        self.num_temps += 1
+        return f"_t{self.num_temps}"
+
+    # refers to a member of the runtime, bound to a local in the prologue
+    def __rt(self, name):
+        self.rt_names.add(name)
+        return _load(name)
+
+    def __compile_function(self, func_ast):
+        self.num_temps = 0
+        self.rt_names = set()
+        body = self.__compile_block(func_ast.get("statements"), 0)
+        body.append(pyast.Return(value=_load("NIL")))
+        prologue = [
+            pyast.Assign(targets=[_store(name)], value=_attr(_load("rt"), name))
+            for name in sorted(self.rt_names | {"NIL"})
+        ]
+        return pyast.FunctionDef(
+            name=self.__func_name(func_ast),
+            args=pyast.arguments(
+                posonlyargs=[],
+                args=[pyast.arg(arg="rt")],
+                kwonlyargs=[],
+                kw_defaults=[],
+                defaults=[],
+            ),
+            body=prologue + body,
+            decorator_list=[],
+            returns=None,
+        )
+
+    # depth is the number of block scopes already open; blocks that can't
+    # create a variable get no scope of their own
+    def __compile_block(self, statements, depth):
+        scoped = may_create_variable(statements)
+        body = []
+        if scoped:
+            body.append(pyast.Expr(value=_call("push")))
+            self.rt_names.add("push")
+            self.rt_names.add("pop")
+            depth += 1
+        for statement in statements:
+            if self.trace_output:
+                body.append(pyast.Expr(value=_call("print", self.__add_const(statement))))
+            body.extend(self.__compile_statement(statement, depth))
+        if scoped:
+            body.append(pyast.Expr(value=_call("pop")))
+        if not body:
+            body.append(pyast.Pass())
+        return body
+
+    def __compile_statement(self, statement, depth):
+        kind = statement.elem_type
+        if kind == InterpreterBase.FCALL_DEF or kind == InterpreterBase.MCALL_DEF:
+            return [pyast.Expr(value=self.__compile_expr(statement))]
+        if kind == "=":
+            var_name, object_var_name = self.__split_var_name(statement.get("name"))
+            value = self.__compile_expr(statement.get("expression"))
+            assign = pyast.Call(
+                func=self.__rt("assign_value"),
+                args=[_const(var_name), _const(object_var_name), value],
+                keywords=[],
+            )
+            return [pyast.Expr(value=assign)]
+        if kind == InterpreterBase.RETURN_DEF:
+            return self.__compile_return(statement, depth)
+        if kind == InterpreterBase.IF_DEF:
+            else_statements = statement.get("else_statements")
+            orelse = []
+            if else_statements is not None:
+                orelse = self.__compile_block(else_statements, depth)
+            return [
+                pyast.If(
+                    test=self.__compile_condition(statement.get("condition"), "if"),
+                    body=self.__compile_block(statement.get("statements"), depth),
+                    orelse=orelse,
+                )
+            ]
+        if kind == InterpreterBase.WHILE_DEF:
+            return [
+                pyast.While(
+                    test=self.__compile_condition(statement.get("condition"), "while"),
+                    body=self.__compile_block(statement.get("statements"), depth),
+                    orelse=[],
+                )
+            ]
+        return []
+
+    # leaves all the block scopes of the function before returning
+    def __compile_return(self, return_ast, depth):
+        expr_ast = return_ast.get("expression")
+        pops = [pyast.Expr(value=_call("pop")) for _ in range(depth)]
+        if expr_ast is None:
+            return pops + [pyast.Return(value=_load("NIL"))]
+        result = self.__temp()
+        value = _call("copy_value", self.__compile_expr(expr_ast))
+        return (
+            [pyast.Assign(targets=[_store(result)], value=value)]
+            + pops
+            + [pyast.Return(value=_load(result))]
+        )
+
+    def __compile_condition(self, cond_ast, kind):
+        result = self.__temp()
+        return pyast.IfExp(
+            test=_is(_attr(_walrus(result, self.__compile_expr(cond_ast)), "t"), _load("BOOL")),
+            body=_attr(_load(result), "v"),
+            orelse=pyast.Call(
+                func=self.__rt("eval_condition"),
+                args=[_load(result), _const(kind)],
+                keywords=[],
+            ),
+        )
+
+    def __compile_expr(self, expr_ast):
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.NIL_DEF:
+            return _load("NIL")
+        if kind == InterpreterBase.INT_DEF:
+            return self.__add_const(literal_value(Type.INT, expr_ast.get("val")))
+        if kind == InterpreterBase.STRING_DEF:
+            return self.__add_const(literal_value(Type.STRING, expr_ast.get("val")))
+        if kind == InterpreterBase.BOOL_DEF:
+            return _load("TRUE" if expr_ast.get("val") else "FALSE")
+        if kind == InterpreterBase.VAR_DEF:
+            var_name, object_var_name = self.__split_var_name(expr_ast.get("name"))
+            if object_var_name is not None and object_var_name != "proto":
+                return pyast.Call(
+                    func=self.__rt("lookup_field"),
+                    args=[_const(var_name), self.__add_const(expr_ast)],
+                    keywords=[],
+                )
+            lookup = pyast.Call(
+                func=self.__rt("lookup_name"),
+                args=[_const(var_name), _const(object_var_name)],
+                keywords=[],
+            )
+            if object_var_name is not None:
+                return lookup
+            # Values are always truthy, so this only looks up functions
+            # when the variable isn't defined
+            get = pyast.Call(func=self.__rt("get"), args=[_const(var_name)], keywords=[])
+            return pyast.BoolOp(op=pyast.Or(), values=[get, lookup])
+        if kind == InterpreterBase.MCALL_DEF:
+            resolve = pyast.Call(
+                func=self.__rt("resolve_method"), args=[self.__add_const(expr_ast)], keywords=[]
+            )
+            return self.__compile_call(resolve, expr_ast.get("args"))
+        if kind == InterpreterBase.FCALL_DEF:
+            return self.__compile_fcall(expr_ast)
+        if kind in ARITH_OPS or kind in COMPARE_OPS:
+            return self.__compile_int_op(expr_ast)
+        if kind == InterpreterBase.NEG_DEF:
+            return self.__compile_unary(expr_ast, "INT", "NEG", pyast.USub)
+        if kind == InterpreterBase.NOT_DEF:
+            return self.__compile_unary(expr_ast, "BOOL", "NOT", pyast.Not)
+        if kind == InterpreterBase.LAMBDA_DEF:
+            self.__func_name(expr_ast)
+            self.pending.append(expr_ast)
+            closure = _call("Closure", self.__add_const(expr_ast), self.__rt("env"))
+            return _call("Value", _load("CLOSURE"), closure)
+        if kind == InterpreterBase.OBJ_DEF:
+            return _call("Value", _load("OBJECT"), _call("Object"))
+        return pyast.Call(
+            func=self.__rt("eval_bin_op"),
+            args=[
+                _const(kind),
+                self.__compile_expr(expr_ast.get("op1")),
+                self.__compile_expr(expr_ast.get("op2")),
+            ],
+            keywords=[],
+        )
+
+    # int_value(a.v + b.v) if (a := left).t is INT & (b := right).t is INT
+    # else eval_bin_op(...); & makes sure that right is always evaluated.
+    # Comparisons produce (TRUE if a.v < b.v else FALSE) instead.
+    def __compile_int_op(self, arith_ast):
+        operation = arith_ast.elem_type
+        left = self.__temp()
+        right = self.__temp()
+        both_ints = pyast.BinOp(
+            left=_is(_attr(_walrus(left, self.__compile_expr(arith_ast.get("op1"))), "t"), _load("INT")),
+            op=pyast.BitAnd(),
+            right=_is(_attr(_walrus(right, self.__compile_expr(arith_ast.get("op2"))), "t"), _load("INT")),
+        )
+        left_value = _attr(_load(left), "v")
+        right_value = _attr(_load(right), "v")
+        if operation in ARITH_OPS:
+            result = _call(
+                "int_value",
+                pyast.BinOp(left=left_value, op=ARITH_OPS[operation](), right=right_value),
+            )
+        else:
+            result = pyast.IfExp(
+                test=pyast.Compare(
+                    left=left_value, ops=[COMPARE_OPS[operation]()], comparators=[right_value]
+                ),
+                body=_load("TRUE"),
+                orelse=_load("FALSE"),
+            )
+        generic = pyast.Call(
+            func=self.__rt("eval_bin_op"),
+            args=[_const(operation), _load(left), _load(right)],
+            keywords=[],
+        )
+        return pyast.IfExp(test=both_ints, body=result, orelse=generic)
+
+    def __compile_unary(self, arith_ast, type_name, func_name, py_op):
+        operand = self.__temp()
+        test = _is(_attr(_walrus(operand, self.__compile_expr(arith_ast.get("op1"))), "t"), _load(type_name))
+        if type_name == "INT":
+            result = _call("int_value", pyast.UnaryOp(op=py_op(), operand=_attr(_load(operand), "v")))
+        else:
+            result = pyast.IfExp(test=_attr(_load(operand), "v"), body=_load("FALSE"), orelse=_load("TRUE"))
+        generic = pyast.Call(
+            func=self.__rt("eval_unary_op"),
+            args=[_const(arith_ast.elem_type), _load(type_name), _load(func_name), _load(operand)],
+            keywords=[],
+        )
+        return pyast.IfExp(test=test, body=result, orelse=generic)
+
+    def __compile_fcall(self, call_ast):
+        func_name = call_ast.get("name")
+        args = call_ast.get("args")
+        if func_name == "print":
+            # print_end(p := [], print_arg(p, arg0), print_arg(p, arg1), ...)
+            pending = self.__temp()
+            first = _walrus(pending, pyast.List(elts=[], ctx=pyast.Load()))
+            print_args = [
+                pyast.Call(
+                    func=self.__rt("print_arg"),
+                    args=[_load(pending), self.__compile_expr(arg)],
+                    keywords=[],
+                )
+                for arg in args
+            ]
+            return pyast.Call(func=self.__rt("print_end"), args=[first] + print_args, keywords=[])
+        if func_name == "inputi" or func_name == "inputs":
+            input_args = [_const(len(args))]
+            # the prompt is only evaluated when it is the single argument
+            if len(args) == 1:
+                input_args.append(self.__compile_expr(args[0]))
+            return pyast.Call(func=self.__rt(func_name), args=input_args, keywords=[])
+        resolve = pyast.Call(func=self.__rt("resolve_func"), args=[self.__add_const(call_ast)], keywords=[])
+        return self.__compile_call(resolve, args)
+
+    # invoke(p := resolve(...), bind(p, 0, arg0), bind(p, 1, arg1), ...), so
+    # the target is resolved before the arguments are evaluated and each
+    # argument is copied before the next one is evaluated. Variables are
+    # bound with bind_var(p, index, var, field) so that a ref parameter can
+    # share their Cell.
+    def __compile_call(self, resolve, args):
+        pending = self.__temp()
+        binds = []
+        for index, arg in enumerate(args):
+            if arg.elem_type == InterpreterBase.VAR_DEF:
+                var_name, object_var_name = self.__split_var_name(arg.get("name"))
+                bind = pyast.Call(
+                    func=self.__rt("bind_var"),
+                    args=[_load(pending), _const(index), _const(var_name), _const(object_var_name)],
+                    keywords=[],
+                )
+            else:
+                bind = pyast.Call(
+                    func=self.__rt("bind"),
+                    args=[_load(pending), _const(index), self.__compile_expr(arg)],
+                    keywords=[],
+                )
+            binds.append(bind)
+        return pyast.Call(
+            func=self.__rt("invoke"), args=[_walrus(pending, resolve)] + binds, keywords=[]
+        )
+
+    def __split_var_name(self, var_name):
+        parts = var_name.split(".")
+        if len(parts) == 2:
+            return parts[0], parts[1]
+        return parts[0], None
+
+
+# programs are compiled once per source text (and trace/optimize setting),
+# parsed with parser, through parse_cache if there is one
+@functools.lru_cache(maxsize=32)
+def get_compiled_program(program, trace_output=False, optimize=False, parse_cache=None, parser="lalr"):
+    if parse_cache is None:
+        ast = parse_program(program, parser)
+    else:
+        ast = parse_cache.parse(program, parser)
+    if optimize:
+        ast = optimize_program(ast)
+    return ast, PythonCompiler(trace_output).compile_program(ast)
+
+
+# The per-run state that the generated functions call into
+class PythonRuntime:
+    def __init__(self, interpreter, functions):
+        self.interpreter = interpreter
+        self.functions = functions
+        self.env = interpreter.env
+        self.push = self.env.push
+        self.pop = self.env.pop
+        self.get = self.env.get
+        self.NIL = interpreter.NIL_VALUE
+        self.lookup_name = interpreter.lookup_name
+        self.assign_value = interpreter.assign_value
+        self.eval_bin_op = interpreter.eval_bin_op
+        self.eval_unary_op = interpreter.eval_unary_op
+        self.eval_condition = interpreter.eval_condition
+        # call ast -> CallSite and o.f ast -> FieldCache; the compiled
+        # program is shared between runs, and these hold the objects of one,
+        # so they are kept here rather than in CONSTS
+        self.call_sites = {}
+        self.field_caches = {}
+
+    def run(self, main_func):
+        _, function = self.functions[main_func.func_ast]
+        function(self)
+
+    def lookup_field(self, var_name, var_ast):
+        field_cache = self.field_caches.get(var_ast)
+        if field_cache is None:
+            field_cache = FieldCache(var_ast.get("name").split(".")[1])
+            self.field_caches[var_ast] = field_cache
+        return self.interpreter.lookup_field(var_name, field_cache)
+
+    # a pending call is [python function, params, new_env, objref or None]
+    def resolve_func(self, call_ast):
+        target_closure = self.interpreter.resolve_call(self.__call_site(call_ast))
+        return self.__pending_call(target_closure, None)
+
+    def resolve_method(self, call_ast):
+        target_closure = self.interpreter.resolve_call(self.__call_site(call_ast))
+        return self.__pending_call(target_closure, call_ast.get("objref"))
+
+    def __call_site(self, call_ast):
+        call_site = self.call_sites.get(call_ast)
+        if call_site is None:
+            call_site = CallSite(call_ast.get("name"), len(call_ast.get("args")), call_ast.get("objref"))
+            self.call_sites[call_ast] = call_site
+        return call_site
+
+    def __pending_call(self, target_closure, mfunc_objref):
+        new_env = {}
+        self.interpreter.prepare_env_with_closed_variables(target_closure, new_env)
+        params, function = self.functions[target_closure.func_ast]
+        return [function, params, new_env, mfunc_objref]
+
+    def bind(self, pending, index, value):
+        arg_name, by_ref = pending[1][index]
+        if by_ref:
+            pending[2][arg_name] = Cell(value)
+        else:
+            pending[2][arg_name] = Cell(copy_value(value))
+
+    def bind_var(self, pending, index, var_name, object_var_name):
+        arg_name, by_ref = pending[1][index]
+        if by_ref:
+            pending[2][arg_name] = self.interpreter.lookup_cell(var_name, object_var_name)
+        else:
+            value = self.interpreter.lookup_name(var_name, object_var_name)
+            pending[2][arg_name] = Cell(copy_value(value))
+
+    def invoke(self, pending, *bound):
+        function, _, new_env, mfunc_objref = pending
+        if mfunc_objref is not None:
+            self.interpreter.bind_this(mfunc_objref, new_env)
+        self.env.push(new_env)
+        return_val = function(self)
+        self.env.pop()
+        return return_val
+
+    def print_arg(self, pending, value):
+        pending.append(printable_arg(value))
+
+    def print_end(self, pending, *printed):
+        self.interpreter.output("".join(pending))
+        return self.NIL
+
+    def inputi(self, num_args, prompt=None):
+        return int_value(int(self.__get_input("inputi", num_args, prompt)))
+
+    def inputs(self, num_args, prompt=None):
+        return Value(Type.STRING, self.__get_input("inputs", num_args, prompt))
+
+    def __get_input(self, func_name, num_args, prompt):
+        if num_args == 1:
+            self.interpreter.output(get_printable(prompt))
+        elif num_args > 1:
+            self.interpreter.error(
+                ErrorType.NAME_ERROR, f"No {func_name}() function that takes > 1 parameter"
+            )
+        return self.interpreter.get_input()
+
+
+# FOR DEBUGGING PURPOSES: python pycompilerv4.py program.br
+def main():
+    import sys
+
+    with open(sys.argv[1]) as source:
+        module = PythonCompiler().translate_program(parse_program(source.read()))
+    print(pyast.unparse(module))
+
+
+if __name__ == "__main__":
+    main()
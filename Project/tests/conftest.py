@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the interpreter's modules sit in the directory above, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# the tree walker recurses through python for every brewin call
+sys.setrecursionlimit(10000)
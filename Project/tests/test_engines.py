@@ -0,0 +1,91 @@
+import functools
+import os
+
+import pytest
+
+import type_valuev4
+from interpreterv4 import Interpreter
+from pycompilerv4 import get_compiled_program
+from type_valuev4 import CallSite, FieldCache
+
+PROGRAMS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "programs")
+NAMES = sorted(name for name in os.listdir(PROGRAMS) if name.endswith(".br"))
+
+# the lines of input each program reads
+INPUTS = {"input.br": ["3", "4"], "inputs.br": ["5", "five", "six"]}
+DEFAULT_INPUT = ["1"]
+
+# the way programs are run that the others are compared with: walking the
+# tree as parsed, in an environment of nested scopes
+REFERENCE = {"engine": "tree", "environment": "deep"}
+
+CONFIGURATIONS = [
+    {"engine": engine, "environment": environment}
+    for engine in sorted(Interpreter.ENGINES)
+    for environment in sorted(Interpreter.ENVIRONMENTS)
+    if {"engine": engine, "environment": environment} != REFERENCE
+]
+CONFIGURATIONS += [
+    {"engine": "tree", "unboxed": True},
+    {"engine": "tree", "unboxed": True, "environment": "deep"},
+    {"engine": "tree", "parser": "descent"},
+    *({"engine": engine, "optimize": True} for engine in sorted(Interpreter.ENGINES)),
+]
+
+
+# runs the program in file name, returning everything it output, the
+# exception it ended with, if any, and the error type and line it logged
+def run(name, **options):
+    with open(os.path.join(PROGRAMS, name)) as file:
+        program = file.read()
+    interpreter = Interpreter(console_output=False, inp=INPUTS.get(name, DEFAULT_INPUT), **options)
+    error = None
+    try:
+        interpreter.run(program)
+    except Exception as exception:
+        error = f"{type(exception).__name__}: {exception}"
+    return list(interpreter.get_output()), error, interpreter.get_error_type_and_line()
+
+
+@functools.lru_cache(maxsize=None)
+def reference_run(name):
+    return run(name, **REFERENCE)
+
+
+def configuration_id(options):
+    return ",".join(f"{key}={value}" for key, value in options.items())
+
+
+@pytest.mark.parametrize("options", CONFIGURATIONS, ids=configuration_id)
+@pytest.mark.parametrize("name", NAMES)
+def test_same_as_reference(name, options):
+    assert run(name, **options) == reference_run(name)
+
+
+def test_corpus_has_errors():
+    # the comparison above covers failing programs too
+    assert sum(reference_run(name)[1] is not None for name in NAMES) >= 20
+
+
+# python programs are compiled once and kept for later runs, so the caches
+# holding a run's objects mustn't be part of them
+def test_compiled_programs_hold_no_caches():
+    with open(os.path.join(PROGRAMS, "shapes.br")) as file:
+        program = file.read()
+    Interpreter(console_output=False, engine="python", inp=DEFAULT_INPUT).run(program)
+    _, functions = get_compiled_program(program)
+    for _, function in functions.values():
+        for const in function.__globals__["CONSTS"]:
+            assert not isinstance(const, (FieldCache, CallSite))
+
+
+# each run starts a new tree of shapes, so it doesn't grow with every
+# program a process runs, while objects built alike in a run share theirs
+@pytest.mark.parametrize("engine", sorted(Interpreter.ENGINES))
+def test_shapes_are_per_run(engine):
+    Interpreter(console_output=False, engine=engine).run("func main() { a = @; a.first = 1; }")
+    interpreter = Interpreter(console_output=False, engine=engine)
+    interpreter.run("func main() { a = @; a.x = 1; a.y = 2; b = @; b.x = 3; b.y = 4; print(a.y + b.y); }")
+    assert interpreter.get_output() == ["6"]
+    assert list(type_valuev4.EMPTY_SHAPE.transitions) == ["x"]
+    assert list(type_valuev4.EMPTY_SHAPE.transitions["x"].transitions) == ["y"]
@@ -0,0 +1,153 @@
+import os
+
+import pytest
+
+from intbase import FileSource, IteratorSource, ListSource, MappedFileSource
+from interpreterv4 import Interpreter
+
+# input that ends lines every way a source has to handle, with lines that
+# are empty, longer than a block or made of characters several bytes long
+TEXTS = [
+    "",
+    "\n",
+    "\r\n",
+    "one",
+    "one\n",
+    "one\r\ntwo\r\n",
+    "one\r\ntwo",
+    "one\r\ntwo\r",
+    "\n\n\r\n\nlast",
+    "a\rb\n\rc\r\n",
+    "héllo wörld\r\nπ ≈ 3.14159\n日本語のテキスト\n😀😀😀",
+    "x" * 100 + "\r\n" + "y" * 37 + "\n\n" + "z" * 64,
+]
+
+SIZES = [1, 2, 3, 5, 64, 1 << 16]
+
+
+# the lines a source reads from text: its lines without their line endings,
+# a \r before a \n included
+def expected_lines(text):
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return [line.removesuffix("\r") for line in lines]
+
+
+def read_all(source):
+    lines = list(iter(source.read_line, None))
+    # and it stays at the end
+    assert source.read_line() is None
+    return lines
+
+
+def write_file(tmp_path, text):
+    path = os.path.join(tmp_path, "input.txt")
+    with open(path, "wb") as file:
+        file.write(text.encode("utf-8"))
+    return path
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("text", TEXTS)
+def test_file_source(tmp_path, text, size):
+    fd = os.open(write_file(tmp_path, text), os.O_RDONLY)
+    try:
+        with FileSource(fd, buffer_size=size) as source:
+            assert read_all(source) == expected_lines(text)
+        # the descriptor is still the caller's
+        os.fstat(fd)
+    finally:
+        os.close(fd)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("text", TEXTS)
+def test_mapped_file_source(tmp_path, text, size):
+    with MappedFileSource(write_file(tmp_path, text), prefetch=size) as source:
+        assert read_all(source) == expected_lines(text)
+    assert source.map == b""
+
+
+# a file read with its lines split only at \n, so they end the way the
+# block sources see them
+@pytest.mark.parametrize("text", TEXTS)
+def test_iterator_source(tmp_path, text):
+    with open(write_file(tmp_path, text), encoding="utf-8", newline="\n") as file:
+        assert read_all(IteratorSource(file)) == expected_lines(text)
+
+
+def test_iterator_source_of_lines():
+    lines = (line for line in ["a\r\n", "\n", "b\n", "c\r", "d"])
+    assert read_all(IteratorSource(lines)) == ["a", "", "b", "c", "d"]
+
+
+def test_list_source():
+    assert read_all(ListSource(["a", "", "b\r"])) == ["a", "", "b\r"]
+
+
+# a program reading lines with both input functions and printing them back
+PROGRAM = """
+func main() {
+  a = inputs("first");
+  b = inputi();
+  c = inputs();
+  print(a, "|", b + 1, "|", c, "|");
+}
+"""
+TEXT = "héllo\r\n41\r\n\r\nunread\n"
+OUTPUT = ["first", "héllo|42||"]
+
+
+class RecordingSource(ListSource):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def run(inp, **options):
+    interpreter = Interpreter(console_output=False, inp=inp, **options)
+    interpreter.run(PROGRAM)
+    return interpreter.get_output()
+
+
+@pytest.mark.parametrize("engine", sorted(Interpreter.ENGINES))
+def test_inputs_read_the_source(tmp_path, engine):
+    path = write_file(tmp_path, TEXT)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        assert run(FileSource(fd, buffer_size=3), engine=engine) == OUTPUT
+    finally:
+        os.close(fd)
+    assert run(MappedFileSource(path, prefetch=2), engine=engine) == OUTPUT
+    with open(path, encoding="utf-8", newline="\n") as file:
+        assert run(file, engine=engine) == OUTPUT
+    assert run(iter(expected_lines(TEXT)), engine=engine) == OUTPUT
+    assert run(expected_lines(TEXT), engine=engine) == OUTPUT
+
+
+# a run closes its source, even when the program fails
+def test_run_closes_the_source(tmp_path):
+    source = RecordingSource(expected_lines(TEXT))
+    run(source)
+    assert source.closed
+    source = RecordingSource(["not a number"] * 3)
+    with pytest.raises(ValueError):
+        run(source)
+    assert source.closed
+    source = MappedFileSource(write_file(tmp_path, TEXT))
+    run(source)
+    assert source.map == b""
+
+
+def test_empty_file(tmp_path):
+    path = write_file(tmp_path, "")
+    assert os.path.getsize(path) == 0
+    with MappedFileSource(path) as source:
+        assert source.read_line() is None
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        assert FileSource(fd).read_line() is None
+    finally:
+        os.close(fd)
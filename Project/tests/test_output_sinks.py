@@ -0,0 +1,128 @@
+import io
+import os
+
+import pytest
+
+import intbase
+from intbase import BufferedSink, ConsoleSink
+from interpreterv4 import Interpreter
+
+PROGRAM = """
+func main() {
+  i = 0;
+  while (i < 5) {
+    print("line ", i);
+    i = i + 1;
+  }
+}
+"""
+FAILING_PROGRAM = """
+func main() {
+  print("before");
+  print(1 + "x");
+}
+"""
+OUTPUT = [f"line {i}" for i in range(5)]
+
+
+@pytest.fixture
+def output_file(tmp_path):
+    path = os.path.join(tmp_path, "output.txt")
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT)
+    yield fd, path
+    os.close(fd)
+
+
+def written(path):
+    with open(path, encoding="utf-8") as file:
+        return file.read()
+
+
+def test_lines_that_are_not_strings(output_file):
+    fd, path = output_file
+    sink = BufferedSink(fd)
+    for line in (None, 5, "é", ""):
+        sink.write(line)
+    sink.flush()
+    assert written(path) == "None\n5\né\n\n"
+
+
+def test_blocks_are_written_once_full(output_file):
+    fd, path = output_file
+    sink = BufferedSink(fd, buffer_size=12)
+    sink.write("abcd")
+    sink.write("efgh")
+    assert written(path) == ""
+    sink.write("ij")  # 15 characters with the newlines
+    assert written(path) == "abcd\nefgh\nij\n"
+    sink.write("k")
+    assert written(path) == "abcd\nefgh\nij\n"
+    sink.flush()
+    assert written(path) == "abcd\nefgh\nij\nk\n"
+    sink.flush()
+    assert written(path) == "abcd\nefgh\nij\nk\n"
+
+
+def test_unbuffered(output_file):
+    fd, path = output_file
+    sink = BufferedSink(fd, buffer_size=0)
+    sink.write("a")
+    assert written(path) == "a\n"
+
+
+# lines whose write fails are written by the next flush
+def test_failed_write_keeps_the_lines(output_file, monkeypatch):
+    fd, path = output_file
+    sink = BufferedSink(fd)
+    sink.write("a")
+    sink.write("b")
+
+    def fail(fd, data):
+        raise OSError("no space left")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(intbase.os, "write", fail)
+        with pytest.raises(OSError):
+            sink.flush()
+    sink.write("c")
+    sink.flush()
+    assert written(path) == "a\nb\nc\n"
+
+
+def test_console_sink():
+    file = io.StringIO()
+    sink = ConsoleSink(file)
+    sink.write("a")
+    sink.write(None)
+    sink.flush()
+    assert file.getvalue() == "a\nNone\n"
+
+
+# a run flushes its output, even when the program fails
+@pytest.mark.parametrize("engine", sorted(Interpreter.ENGINES))
+def test_run_flushes(output_file, engine):
+    fd, path = output_file
+    Interpreter(output_sink=BufferedSink(fd), engine=engine).run(PROGRAM)
+    assert written(path) == "".join(line + "\n" for line in OUTPUT)
+    with pytest.raises(Exception):
+        Interpreter(output_sink=BufferedSink(fd), engine=engine).run(FAILING_PROGRAM)
+    assert written(path).endswith("line 4\nbefore\n")
+
+
+@pytest.mark.parametrize(
+    "max_output_log, log",
+    [(None, OUTPUT), (0, []), (1, OUTPUT[-1:]), (3, OUTPUT[-3:]), (5, OUTPUT), (100, OUTPUT)],
+)
+def test_output_log(max_output_log, log):
+    interpreter = Interpreter(console_output=False, max_output_log=max_output_log)
+    interpreter.run(PROGRAM)
+    assert interpreter.get_output() == log
+
+
+# the sink gets every line whatever the log keeps
+def test_output_log_and_sink(output_file):
+    fd, path = output_file
+    interpreter = Interpreter(output_sink=BufferedSink(fd), max_output_log=2)
+    interpreter.run(PROGRAM)
+    assert interpreter.get_output() == OUTPUT[-2:]
+    assert written(path) == "".join(line + "\n" for line in OUTPUT)
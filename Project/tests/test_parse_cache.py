@@ -0,0 +1,88 @@
+import os
+
+import parse_cachev4
+from brewparse import parse_program
+from parse_cachev4 import ParseCache
+from test_parsers import tree_key
+
+PROGRAM = """
+func main() {
+  a = @;
+  a.f = lambda(x) { return x * 2 + 1; };
+  print(a.f(20), "x", true);
+}
+"""
+
+
+def cached_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(ParseCache.SUFFIX))
+
+
+# a program with an expression nested depth deep
+def nested_program(depth):
+    return "func main() { print(" + "+".join(["1"] * depth) + "); }"
+
+
+def test_hit_is_the_parsed_tree(tmp_path, monkeypatch):
+    cache = ParseCache(str(tmp_path))
+    assert tree_key(cache.parse(PROGRAM)) == tree_key(parse_program(PROGRAM))
+    assert len(cached_files(tmp_path)) == 1
+
+    def fail(program, parser="lalr"):
+        raise AssertionError("parsed a cached program")
+
+    monkeypatch.setattr(parse_cachev4, "parse_program", fail)
+    assert tree_key(ParseCache(str(tmp_path)).parse(PROGRAM)) == tree_key(parse_program(PROGRAM))
+
+
+def test_unreadable_files_are_parsed_again(tmp_path):
+    cache = ParseCache(str(tmp_path))
+    cache.parse(PROGRAM)
+    (name,) = cached_files(tmp_path)
+    path = os.path.join(tmp_path, name)
+    with open(path, "rb") as file:
+        data = file.read()
+    for broken in (b"", data[: len(data) // 2], b"not marshal data", data[:-1] + b"\xff"):
+        with open(path, "wb") as file:
+            file.write(broken)
+        assert tree_key(cache.parse(PROGRAM)) == tree_key(parse_program(PROGRAM))
+
+
+def test_eviction_removes_the_oldest_files(tmp_path):
+    cache = ParseCache(str(tmp_path), max_bytes=1 << 30)
+    # files parsed earlier are given earlier modification times
+    by_age = []
+    for n in range(6):
+        cache.parse(PROGRAM.replace("20", str(n)))
+        (name,) = set(cached_files(tmp_path)) - set(by_age)
+        os.utime(os.path.join(tmp_path, name), (1000 + n, 1000 + n))
+        by_age.append(name)
+    size = max(os.path.getsize(os.path.join(tmp_path, name)) for name in by_age)
+
+    # with room for three files, writing a seventh leaves it and the two newest
+    cache = ParseCache(str(tmp_path), max_bytes=3 * size + size // 2)
+    cache.parse(PROGRAM.replace("20", "6"))
+    remaining = cached_files(tmp_path)
+    assert sum(os.path.getsize(os.path.join(tmp_path, name)) for name in remaining) <= cache.max_bytes
+    assert len(remaining) == 3
+    assert set(by_age[-2:]) < set(remaining)
+
+
+def test_reading_refreshes_a_file(tmp_path):
+    cache = ParseCache(str(tmp_path))
+    cache.parse(PROGRAM)
+    (name,) = cached_files(tmp_path)
+    path = os.path.join(tmp_path, name)
+    os.utime(path, (1000, 1000))
+    cache.parse(PROGRAM)
+    assert os.path.getmtime(path) > 1000
+
+
+# trees too deep for marshal, or for encoding them without running out of
+# stack, are parsed every time rather than failing
+def test_deep_trees_are_not_cached(tmp_path):
+    cache = ParseCache(str(tmp_path))
+    for depth in (3000, 12000):
+        assert cache.parse(nested_program(depth)).elem_type == "program"
+    assert cached_files(tmp_path) == []
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
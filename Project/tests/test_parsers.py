@@ -0,0 +1,93 @@
+import contextlib
+import io
+import os
+import random
+
+import pytest
+
+from brewgen import random_function
+from brewparse import parse_program
+from element import Element
+
+PROGRAMS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "programs")
+NAMES = sorted(name for name in os.listdir(PROGRAMS) if name.endswith(".br"))
+
+RANDOM_PROGRAMS = 500
+
+
+# parses program with parser, returning its tree as nested tuples (so trees
+# compare equal only if they're identical, down to the types of the values
+# and the order of the fields) or None on a syntax error, and what it printed
+def parse_outcome(program, parser):
+    printed = io.StringIO()
+    with contextlib.redirect_stdout(printed):
+        try:
+            ast = parse_program(program, parser)
+        except SyntaxError:
+            return None, printed.getvalue()
+    return tree_key(ast), printed.getvalue()
+
+
+def tree_key(value):
+    if isinstance(value, Element):
+        return (value.elem_type, tuple((key, tree_key(field)) for key, field in value.items()))
+    if isinstance(value, list):
+        return [tree_key(item) for item in value]
+    return (type(value).__name__, value)
+
+
+# the descent parser has to build the tree yacc's does, and report the same
+# syntax error; programs yacc recovers from after reporting an error are
+# rejected by the descent parser, so only the report is compared for them
+def assert_same_parse(program):
+    lalr, lalr_printed = parse_outcome(program, "lalr")
+    descent, descent_printed = parse_outcome(program, "descent")
+    if lalr_printed:
+        assert descent is None
+        assert lalr_printed.startswith(descent_printed)
+    else:
+        assert lalr == descent
+        assert not descent_printed
+
+
+@pytest.mark.parametrize("name", NAMES)
+def test_corpus(name):
+    with open(os.path.join(PROGRAMS, name)) as file:
+        assert_same_parse(file.read())
+
+
+def test_random_programs():
+    rng = random.Random(0)
+    for _ in range(RANDOM_PROGRAMS):
+        assert_same_parse(" ".join(random_function(rng)))
+
+
+# random programs with a token removed or repeated, which are mostly
+# syntax errors
+def test_broken_programs():
+    rng = random.Random(1)
+    for _ in range(RANDOM_PROGRAMS):
+        tokens = random_function(rng)
+        position = rng.randrange(len(tokens))
+        if rng.random() < 0.5:
+            del tokens[position]
+        else:
+            tokens.insert(position, tokens[position])
+        assert_same_parse(" ".join(tokens))
+
+
+@pytest.mark.parametrize(
+    "program",
+    [
+        "",
+        "func main() { }",
+        "func main() { a.b.c = 1; }",
+        "func main() { x = 1 }",
+        "func main() { return",
+        "func main() { print(1); } x",
+        "func main() { f(1,); }",
+        "func main() { a = - - !b * c - d < e == f && g || h; }",
+    ],
+)
+def test_edge_cases(program):
+    assert_same_parse(program)
@@ -0,0 +1,69 @@
+import contextlib
+import io
+import os
+import random
+
+import pytest
+
+from brewgen import random_source
+from brewlex import build_lexer
+from brewscan import scan
+
+PROGRAMS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "programs")
+NAMES = sorted(name for name in os.listdir(PROGRAMS) if name.endswith(".br"))
+
+# programs brewscan and ply's lexer may not agree on if they handle
+# characters no rule matches differently
+ODD_PROGRAMS = [
+    'print("unclosed\n");',
+    "a\r\nb é ٣ 2x",
+    "a /* open",
+    "a /* open /* open */ b / * c",
+    '"" "a" """',
+    "/* a\n comment */ x\n\n  y /**/ z",
+]
+
+
+# the tokens ply's lexer finds in program as brewscan gives them, with lines
+# counted from the start of program, and what it printed
+def ply_scan(program):
+    lexer = build_lexer()
+    lexer.input(program)
+    lexer.lineno = 1
+    tokens = []
+    printed = io.StringIO()
+    with contextlib.redirect_stdout(printed):
+        for token in iter(lexer.token, None):
+            column = token.lexpos - program.rfind("\n", 0, token.lexpos)
+            tokens.append((token.type, token.value, token.lineno, column))
+    return tokens, printed.getvalue()
+
+
+def brewscan_scan(program):
+    printed = io.StringIO()
+    with contextlib.redirect_stdout(printed):
+        tokens = scan(program)
+    return tokens, printed.getvalue()
+
+
+@pytest.mark.parametrize("program", ODD_PROGRAMS)
+def test_odd_programs(program):
+    assert brewscan_scan(program) == ply_scan(program)
+
+
+@pytest.mark.parametrize("name", NAMES)
+def test_corpus(name):
+    with open(os.path.join(PROGRAMS, name)) as file:
+        program = file.read()
+    assert brewscan_scan(program) == ply_scan(program)
+
+
+def test_random_programs():
+    program = random_source(random.Random(0), 500)
+    assert brewscan_scan(program) == ply_scan(program)
+
+
+# lines are counted from the start of every program scanned
+def test_lines_start_over():
+    scan("a\nb\nc")
+    assert scan("x") == [("NAME", "x", 1, 1)]
@@ -1,6 +1,5 @@
-import copy
-
 from enum import Enum
+from freevarsv4 import free_variables
 from intbase import InterpreterBase, ErrorType
 
 
@@ -13,45 +12,333 @@ class Type(Enum):
     NIL = 5
     OBJECT = 6
 
+# A variable, field or prototype slot. Values are immutable, so assigning to
+# a variable replaces the Value held by its Cell; ref parameters, this and
+# the variables captured by a closure share the Cell itself.
+class Cell:
+    __slots__ = ("value",)
+
+    def __init__(self, value=None):
+        self.value = value
+
+
+# The layout of objects with the same fields added in the same order: which
+# slot holds each field. Adding a field moves an object to the next shape in
+# the transition tree, so objects built alike share one Shape.
+class Shape:
+    __slots__ = ("fields", "transitions")
+
+    def __init__(self, fields):
+        self.fields = fields  # field name -> slot index
+        self.transitions = {}  # field name -> Shape with it added
+
+    def with_field(self, symbol):
+        shape = self.transitions.get(symbol)
+        if shape is None:
+            fields = dict(self.fields)
+            fields[symbol] = len(fields)
+            shape = Shape(fields)
+            self.transitions[symbol] = shape
+        return shape
+
+
+# the shape of objects without fields, the root of the tree
+EMPTY_SHAPE = Shape({})
+
+
+# starts a new transition tree, which interpreters do for every run, so the
+# tree only ever holds the shapes of the program running rather than those
+# of every program a process has run; objects left from earlier runs keep
+# their shapes, they just aren't shared with new objects
+def reset_shapes():
+    global EMPTY_SHAPE
+    EMPTY_SHAPE = Shape({})
+
+
 class Object:
+    # changes whenever an object that is some object's prototype gets a new
+    # field or a new prototype, see FieldCache
+    proto_epoch = 0
+
+    __slots__ = ("shape", "slots", "proto", "is_prototype")
+
     def __init__(self):
-        self.objectEnv = {}
-        self.proto = None
+        self.shape = EMPTY_SHAPE
+        # field Values in slot order; a field whose Cell has been handed out
+        # (see getCell) holds that Cell instead
+        self.slots = []
+        self.proto = None  # ProtoCell holding the prototype, if there is one
+        self.is_prototype = False  # has been made some object's prototype
 
     def getProto(self):
+        if self.proto is None:
+            return None
+        return self.proto.value
+
+    def getProtoCell(self):
         return self.proto
 
     def setProto(self, proto):
-        self.proto = proto
+        if self.is_prototype:
+            Object.proto_epoch += 1
+        if proto is None:
+            self.proto = None
+        else:
+            self.proto = ProtoCell(proto)
 
+    # every assignment creates a new field, so ref parameters bound to the old
+    # one no longer see it
     def addOrUpdate(self, symbol, value):
-        self.objectEnv[symbol] = value
+        index = self.shape.fields.get(symbol)
+        if index is None:
+            if self.is_prototype:
+                Object.proto_epoch += 1
+            self.shape = self.shape.with_field(symbol)
+            self.slots.append(value)
+        else:
+            self.slots[index] = value
+
+    # returns the Cell of a field, so it can be shared by a ref parameter
+    def getCell(self, symbol):
+        obj = self
+        index = self.shape.fields.get(symbol)
+        if index is None:
+            obj, index = find_field(self, symbol)
+            if obj is None:
+                return None
+        slot = obj.slots[index]
+        if slot.__class__ is not Cell:
+            slot = obj.slots[index] = Cell(slot)
+        return slot
 
     def getObj(self, symbol):
-        if symbol in self.objectEnv:
-            return self.objectEnv[symbol]
-        
-        if self.getProto() is not None:
-            prototype = self.getProto()
-            objVal = prototype.value().getObj(symbol)
-            return objVal
-
-        return None
-    
+        obj = self
+        index = self.shape.fields.get(symbol)
+        if index is None:
+            obj, index = find_field(self, symbol)
+            if obj is None:
+                return None
+        slot = obj.slots[index]
+        if slot.__class__ is Cell:
+            return slot.value
+        return slot
+
+    # field name -> Value of the object's own fields
     def getObjectEnv(self):
-        return self.objectEnv
+        return {symbol: self.getObj(symbol) for symbol in self.shape.fields}
+
+    # copies the whole graph reachable from this object (see copy_value)
+    def __deepcopy__(self, memo):
+        copied = Object()
+        memo[id(self)] = copied
+        copied.shape = self.shape
+        for slot in self.slots:
+            if slot.__class__ is Cell:
+                slot = slot.value
+            copied.slots.append(copy_value(slot, memo))
+        if self.proto is not None:
+            copied.proto = ProtoCell(copy_value(self.proto.value, memo))
+        return copied
 
 
+# Nothing stops a program from making an object its own prototype, e.g.
+# a.proto = b; b.proto = a; so once a walk up a prototype chain has taken
+# more than this many links, the objects it reaches are remembered and
+# reaching one again raises RecursionError, as looking up a field missing
+# from such a chain always has.
+MAX_UNCHECKED_PROTOS = 64
+
+
+# returns the object in obj's prototype chain, starting with obj itself,
+# that has the field symbol and the index of its slot, or None, None
+def find_field(obj, symbol):
+    links = 0
+    seen = None
+    while True:
+        index = obj.shape.fields.get(symbol)
+        if index is not None:
+            return obj, index
+        if obj.proto is None:
+            return None, None
+        obj = obj.proto.value.v
+        links += 1
+        if links > MAX_UNCHECKED_PROTOS:
+            if seen is None:
+                seen = set()
+            elif id(obj) in seen:
+                raise RecursionError(f"The prototype chain looked up for {symbol} is a cycle")
+            seen.add(id(obj))
+
+
+# The Cell holding an object's prototype. A ref parameter bound to o.proto
+# can assign to it directly, which has to be seen by FieldCache as well.
+class ProtoCell(Cell):
+    __slots__ = ("prototype",)
+
+    def __init__(self, value):
+        self.prototype = value
+        if value.__class__ is Value and value.t is Type.OBJECT:
+            value.v.is_prototype = True
+
+    @property
+    def value(self):
+        return self.prototype
+
+    @value.setter
+    def value(self, value):
+        self.prototype = value
+        if value.__class__ is Value and value.t is Type.OBJECT:
+            value.v.is_prototype = True
+        Object.proto_epoch += 1
+
+
+# An inline cache for one o.f read or o.f(...) call in the program. Fields
+# of o itself take a single probe of its shape, as cheap as any cache; for
+# the last few shapes of o without f it holds the object up the prototype
+# chain that f was found in, together with o's prototype Value and
+# Object.proto_epoch, which changes when anything further up a chain does.
+# A site that sees more than MAX_ENTRIES of those stops caching. The entries
+# hold objects of the run the cache is used in, so each run makes its own.
+class FieldCache:
+    MAX_ENTRIES = 4
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.entries = []  # (shape, prototype Value, epoch, object holding f, slot index)
+        self.megamorphic = False
+
+    # returns obj's field, or None if it doesn't have one, like Object.getObj
+    def get(self, obj):
+        shape = obj.shape
+        index = shape.fields.get(self.symbol)
+        if index is not None:
+            slot = obj.slots[index]
+        else:
+            for entry_shape, proto, epoch, holder, index in self.entries:
+                if (
+                    entry_shape is shape
+                    and epoch == Object.proto_epoch
+                    and obj.proto is not None
+                    and obj.proto.value is proto
+                ):
+                    slot = holder.slots[index]
+                    break
+            else:
+                return self.__miss(obj)
+        if slot.__class__ is Cell:
+            return slot.value
+        return slot
+
+    def __miss(self, obj):
+        if self.megamorphic:
+            return obj.getObj(self.symbol)
+        holder, index = find_field(obj, self.symbol)
+        if holder is None:
+            return None
+        proto = obj.proto.value
+        # drop the entry this one replaces, and any that are out of date
+        self.entries = [
+            entry
+            for entry in self.entries
+            if entry[2] == Object.proto_epoch and not (entry[0] is obj.shape and entry[1] is proto)
+        ]
+        if len(self.entries) < FieldCache.MAX_ENTRIES:
+            self.entries.append((obj.shape, proto, Object.proto_epoch, holder, index))
+        else:
+            self.entries = []
+            self.megamorphic = True
+        slot = holder.slots[index]
+        if slot.__class__ is Cell:
+            return slot.value
+        return slot
+
 
 class Closure:
+    __slots__ = ("captured_env", "func_ast", "type", "shared", "called")
+
     def __init__(self, func_ast, env):
-        self.captured_env = copy.deepcopy(env)
+        # the variables visible where the closure is created, by name;
+        # only the ones its body uses when that can be worked out
+        names = free_variables(func_ast)
+        if names is None:
+            self.captured_env = copy_cells(env)
+        else:
+            self.captured_env = copy_cells(
+                (var_name, cell)
+                for var_name in names
+                if (cell := env.get_cell(var_name)) is not None
+            )
         self.func_ast = func_ast
         self.type = Type.CLOSURE
+        self.shared = False  # captured_env is shared with a copy
+        self.called = False  # captured_env has been bound into a call
+
+    # returns captured_env to bind into a call, which may assign to its Cells,
+    # so a closure sharing it with a copy gets its own Cells first
+    def captured_cells(self):
+        if self.shared:
+            self.captured_env = copy_cells(self.captured_env.items())
+            self.shared = False
+        self.called = True
+        return self.captured_env
+
+    # a copy shares captured_env until either closure is called; once the
+    # closure has been called a call may still be using its Cells, so the
+    # copy gets its own right away
+    def __deepcopy__(self, memo):
+        copied = Closure.__new__(Closure)
+        memo[id(self)] = copied
+        copied.func_ast = self.func_ast
+        copied.type = self.type
+        copied.called = False
+        if self.called:
+            copied.captured_env = copy_cells(self.captured_env.items())
+            copied.shared = False
+        else:
+            copied.captured_env = self.captured_env
+            copied.shared = self.shared = True
+        return copied
 
 
-# Represents a value, which has a type and its value
+# What a call node resolved to, kept by the engines for each fcall/mcall in
+# the program (see Interpreter.resolve_call). Top-level functions take
+# precedence over variables, so once a call finds one it always will; calls
+# through a variable or field only skip the checks while it still holds the
+# same closure Value.
+class CallSite:
+    def __init__(self, func_name, num_params, mfunc_objref=None):
+        self.func_name = func_name
+        self.num_params = num_params
+        self.mfunc_objref = mfunc_objref
+        if mfunc_objref is not None:
+            self.field_cache = FieldCache(func_name)  # finds the method
+        self.func_closure = None  # the top-level function called
+        self.value_obj = None  # the closure Value called last time
+        self.closure = None  # its closure
+
+
+# Copies (name, Cell) pairs into a new {name: Cell}. Values are immutable, so
+# a new Cell holding the same Value is a full copy of a variable; the only
+# captured Values that are objects or closures are never used beyond their
+# type (see Interpreter.prepare_env_with_closed_variables). Names that
+# shared a Cell still share one in the copy.
+def copy_cells(variables):
+    cells = {}
+    copies = {}
+    for var_name, cell in variables:
+        copied = copies.get(id(cell))
+        if copied is None:
+            copied = Cell(cell.value)
+            copies[id(cell)] = copied
+        cells[var_name] = copied
+    return cells
+
+
+# Represents a value, which has a type and its value. Values are never
+# modified once created (variables are Cells), so they can be shared.
 class Value:
+    __slots__ = ("t", "v")
+
     def __init__(self, t, v=None):
         self.t = t
         self.v = v
@@ -62,24 +349,169 @@ class Value:
     def type(self):
         return self.t
 
-    def set(self, other):
-        self.t = other.t
-        self.v = other.v
+    def __deepcopy__(self, memo):
+        return copy_value(self, memo)
+
+
+# A STRING Value made by appending to a long string, as s = s + "x" does in
+# a loop. Doing that to python strings copies s every time; ropes appended to
+# one another share a list of pieces instead, each rope being the first count
+# of them, so appending to the rope that ends the list only appends to the
+# list. The pieces are joined the first time v is read, to print or compare.
+class RopeValue(Value):
+    __slots__ = ("pieces", "count", "flat")
+
+    def __init__(self, pieces, count):
+        self.t = Type.STRING
+        self.pieces = pieces
+        self.count = count
+        self.flat = None  # the joined pieces, once v has been read
+
+    @property
+    def v(self):
+        if self.flat is None:
+            pieces = self.pieces
+            if len(pieces) != self.count:
+                pieces = pieces[: self.count]
+            self.flat = "".join(pieces)
+        return self.flat
+
+    def append(self, string):
+        if self.flat is not None:
+            # starts a new list, so the pieces aren't joined again
+            return RopeValue([self.flat, string], 2)
+        pieces = self.pieces
+        if len(pieces) != self.count:
+            # another rope has been appended to this one already
+            pieces = pieces[: self.count]
+        pieces.append(string)
+        return RopeValue(pieces, self.count + 1)
+
+
+# strings shorter than this are concatenated directly
+ROPE_MIN_LENGTH = 64
+
+
+# the + of two STRING Values
+def concat_strings(left_value_obj, right_value_obj):
+    if left_value_obj.__class__ is RopeValue:
+        return left_value_obj.append(right_value_obj.v)
+    left = left_value_obj.v
+    right = right_value_obj.v
+    if len(left) + len(right) < ROPE_MIN_LENGTH:
+        return Value(Type.STRING, left + right)
+    return RopeValue([left, right], 2)
+
+
+# Returns the copy of a Value that is passed to a parameter by value or
+# returned from a function. Only objects and closures hold anything mutable;
+# everything reachable from them is copied once per call of copy_value, so
+# shared and cyclic references are kept.
+def copy_value(value_obj, memo=None):
+    if value_obj.__class__ is Value and (value_obj.t is Type.OBJECT or value_obj.t is Type.CLOSURE):
+        if memo is None:
+            memo = {}
+        copied = memo.get(id(value_obj.v))
+        if copied is None:
+            copied = value_obj.v.__deepcopy__(memo)
+        return Value(value_obj.t, copied)
+    return value_obj
+
+
+# shared Values for nil, the bools, small ints and string literals
+NIL = Value(Type.NIL, None)
+TRUE = Value(Type.BOOL, True)
+FALSE = Value(Type.BOOL, False)
+SMALL_INT_MIN = -128
+SMALL_INT_MAX = 1024
+SMALL_INTS = tuple(Value(Type.INT, i) for i in range(SMALL_INT_MIN, SMALL_INT_MAX + 1))
+# the string literals of the programs run so far, until there are more than
+# MAX_STRING_LITERALS of them, when they're all dropped; a process running
+# many programs would otherwise keep every literal any of them had
+STRING_LITERALS = {}
+MAX_STRING_LITERALS = 4096
+
+
+def int_value(v):
+    if SMALL_INT_MIN <= v <= SMALL_INT_MAX:
+        return SMALL_INTS[v - SMALL_INT_MIN]
+    return Value(Type.INT, v)
+
+
+def bool_value(v):
+    if v:
+        return TRUE
+    return FALSE
+
+
+# returns the Value for a literal in the program; strings computed while
+# running aren't interned, so the table only grows with the program text
+# (and is bounded, see STRING_LITERALS)
+def literal_value(t, v):
+    if t is Type.INT:
+        return int_value(v)
+    if t is Type.BOOL:
+        return bool_value(v)
+    if t is Type.NIL:
+        return NIL
+    value_obj = STRING_LITERALS.get(v)
+    if value_obj is None:
+        if len(STRING_LITERALS) >= MAX_STRING_LITERALS:
+            STRING_LITERALS.clear()
+        value_obj = Value(Type.STRING, v)
+        STRING_LITERALS[v] = value_obj
+    return value_obj
+
 
 def create_value(val):
     if val == InterpreterBase.TRUE_DEF:
-        return Value(Type.BOOL, True)
+        return TRUE
     elif val == InterpreterBase.FALSE_DEF:
-        return Value(Type.BOOL, False)
+        return FALSE
     elif isinstance(val, int):
-        return Value(Type.INT, val)
+        return int_value(val)
     elif val == InterpreterBase.NIL_DEF:
-        return Value(Type.NIL, None)
+        return NIL
     elif isinstance(val, str):
-        return Value(Type.STRING, val)
+        return literal_value(Type.STRING, val)
+
+
+# Interpreter(unboxed=True) represents ints, bools and strings by the python
+# value itself; only nil, closures, objects and ropes are Values. Nil stays
+# the shared NIL, as a Cell holding None is a variable that isn't visible yet.
+PYTHON_TYPES = {int: Type.INT, bool: Type.BOOL, str: Type.STRING}
+
+
+# the Type of a Value or of an unboxed value
+def type_of(value):
+    t = PYTHON_TYPES.get(value.__class__)
+    if t is None:
+        return value.t
+    return t
+
+
+# the Value for an unboxed value, for the code that only handles Values
+def box(value):
+    cls = value.__class__
+    if cls is int:
+        return int_value(value)
+    if cls is bool:
+        return bool_value(value)
+    if cls is str:
+        return Value(Type.STRING, value)
+    return value
+
+
+def unbox(value_obj):
+    t = value_obj.t
+    if t is Type.INT or t is Type.BOOL or (t is Type.STRING and value_obj.__class__ is Value):
+        return value_obj.v
+    return value_obj
 
 
 def get_printable(val):
+    if val.__class__ is not Value:
+        val = box(val)
     if val.type() == Type.INT:
         return str(val.value())
     if val.type() == Type.STRING:
@@ -89,3 +521,12 @@ def get_printable(val):
             return "true"
         return "false"
     return None
+
+
+# get_printable for an argument of print(), which is output by joining them;
+# anything else fails with the error concatenating it to the output raised
+def printable_arg(val):
+    printable = get_printable(val)
+    if printable is None:
+        raise TypeError('can only concatenate str (not "NoneType") to str')
+    return printable
@@ -0,0 +1,194 @@
+from bytecodev4 import *
+from closure_compilerv4 import INT_OPS
+from intbase import ErrorType
+from type_valuev4 import Cell, Object, Closure, Type, Value, bool_value, copy_value, get_printable, int_value, printable_arg
+
+
+# Executes the CodeObjects produced by bytecodev4.Compiler with a dispatch
+# loop over a value stack. Each function or lambda is compiled the first time
+# it is called. Calls don't recurse in python: the caller's code, pc and value
+# stack are saved on a frame stack and the loop continues in the callee, so
+# the depth of brewin recursion is only limited by memory. As with the closure
+# engine, everything that isn't dispatch is delegated to the Interpreter so
+# that output and errors match the tree walker.
+class VirtualMachine:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.env = interpreter.env
+        self.nil_value = interpreter.NIL_VALUE
+        self.compiler = Compiler(interpreter.trace_output)
+        self.codes = {}  # func/lambda ast -> CodeObject
+
+    def run(self, main_func):
+        self.__execute(self.__get_code(main_func.func_ast))
+
+    def __get_code(self, func_ast):
+        code_obj = self.codes.get(func_ast)
+        if code_obj is None:
+            code_obj = self.compiler.compile_function(func_ast)
+            self.codes[func_ast] = code_obj
+        return code_obj
+
+    # runs code_obj, and everything it calls, until it returns
+    def __execute(self, code_obj):
+        frames = []  # (code_obj, pc, stack) of each suspended caller
+        code = code_obj.code
+        consts = code_obj.consts
+        interpreter = self.interpreter
+        env = self.env
+        env_get = env.get
+        lookup_name = interpreter.lookup_name
+        eval_bin_op = interpreter.eval_bin_op
+        eval_condition = interpreter.eval_condition
+        int_type = Type.INT
+        bool_type = Type.BOOL
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+        while True:
+            opcode = code[pc]
+            arg = code[pc + 1]
+            pc += 2
+            if opcode == LOAD_NAME:
+                var_name = consts[arg]
+                val = env_get(var_name)
+                if val is None:
+                    val = lookup_name(var_name, None)
+                push(val)
+            elif opcode == PUSH_CONST:
+                push(consts[arg])
+            elif opcode == BINARY_OP:
+                right_value_obj = pop()
+                left_value_obj = pop()
+                operation = consts[arg]
+                int_op = INT_OPS.get(operation)
+                if (
+                    int_op is not None
+                    and left_value_obj.t is int_type
+                    and right_value_obj.t is int_type
+                ):
+                    push(int_op[0](int_op[1](left_value_obj.v, right_value_obj.v)))
+                else:
+                    push(eval_bin_op(operation, left_value_obj, right_value_obj))
+            elif opcode == STORE:
+                var_name, object_var_name = consts[arg]
+                interpreter.assign_value(var_name, object_var_name, pop())
+            elif opcode == IF_FALSE or opcode == WHILE_FALSE:
+                result = pop()
+                if result.t is bool_type:
+                    taken = result.v
+                else:
+                    taken = eval_condition(result, "if" if opcode == IF_FALSE else "while")
+                if not taken:
+                    pc = arg
+            elif opcode == JUMP:
+                pc = arg
+            elif opcode == PUSH_SCOPE:
+                env.push()
+            elif opcode == POP_SCOPE:
+                env.pop()
+            elif opcode == RESOLVE_FUNC:
+                target_closure = interpreter.resolve_call(consts[arg])
+                new_env = {}
+                interpreter.prepare_env_with_closed_variables(target_closure, new_env)
+                push([self.__get_code(target_closure.func_ast), new_env, None])
+            elif opcode == RESOLVE_METHOD:
+                call_site = consts[arg]
+                mfunc_objref = call_site.mfunc_objref
+                target_closure = interpreter.resolve_call(call_site)
+                new_env = {}
+                interpreter.prepare_env_with_closed_variables(target_closure, new_env)
+                push([self.__get_code(target_closure.func_ast), new_env, mfunc_objref])
+            elif opcode == BIND_ARG:
+                result = pop()
+                callee, new_env, _ = stack[-1]
+                arg_name, by_ref = callee.params[arg]
+                if by_ref:
+                    new_env[arg_name] = Cell(result)
+                else:
+                    new_env[arg_name] = Cell(copy_value(result))
+            elif opcode == BIND_VAR:
+                index, var_name, object_var_name = consts[arg]
+                callee, new_env, _ = stack[-1]
+                arg_name, by_ref = callee.params[index]
+                if by_ref:
+                    new_env[arg_name] = interpreter.lookup_cell(var_name, object_var_name)
+                else:
+                    new_env[arg_name] = Cell(copy_value(lookup_name(var_name, object_var_name)))
+            elif opcode == CALL:
+                callee, new_env, mfunc_objref = pop()
+                if mfunc_objref is not None:
+                    interpreter.bind_this(mfunc_objref, new_env)
+                env.push(new_env)
+                frames.append((code_obj, pc, stack))
+                code_obj = callee
+                code = code_obj.code
+                consts = code_obj.consts
+                stack = []
+                push = stack.append
+                pop = stack.pop
+                pc = 0
+            elif opcode == RETURN or opcode == RETURN_NIL:
+                if opcode == RETURN:
+                    return_val = copy_value(pop())
+                else:
+                    return_val = self.nil_value
+                for _ in range(arg):
+                    env.pop()
+                if not frames:
+                    return return_val
+                env.pop()  # the parameters pushed by CALL
+                code_obj, pc, stack = frames.pop()
+                code = code_obj.code
+                consts = code_obj.consts
+                push = stack.append
+                pop = stack.pop
+                push(return_val)
+            elif opcode == POP:
+                pop()
+            elif opcode == LOAD_FIELD:
+                var_name, field_cache = consts[arg]
+                push(interpreter.lookup_field(var_name, field_cache))
+            elif opcode == LOAD_PROTO:
+                push(lookup_name(consts[arg], "proto"))
+            elif opcode == PUSH_NIL:
+                push(self.nil_value)
+            elif opcode == UNARY_NEG:
+                value_obj = pop()
+                if value_obj.t is int_type:
+                    push(int_value(-1 * value_obj.v))
+                else:
+                    push(interpreter.eval_unary_op("neg", int_type, lambda x: -1 * x, value_obj))
+            elif opcode == UNARY_NOT:
+                value_obj = pop()
+                if value_obj.t is bool_type:
+                    push(bool_value(not value_obj.v))
+                else:
+                    push(interpreter.eval_unary_op("!", bool_type, lambda x: not x, value_obj))
+            elif opcode == PRINT_BEGIN:
+                push([])
+            elif opcode == PRINT_ARG:
+                result = pop()
+                stack[-1].append(printable_arg(result))
+            elif opcode == PRINT_END:
+                interpreter.output("".join(pop()))
+                push(self.nil_value)
+            elif opcode == INPUTI or opcode == INPUTS:
+                if arg == 1:
+                    interpreter.output(get_printable(pop()))
+                elif arg > 1:
+                    func_name = "inputi" if opcode == INPUTI else "inputs"
+                    interpreter.error(
+                        ErrorType.NAME_ERROR, f"No {func_name}() function that takes > 1 parameter"
+                    )
+                if opcode == INPUTI:
+                    push(int_value(int(interpreter.get_input())))
+                else:
+                    push(Value(Type.STRING, interpreter.get_input()))
+            elif opcode == MAKE_CLOSURE:
+                push(Value(Type.CLOSURE, Closure(consts[arg], env)))
+            elif opcode == MAKE_OBJECT:
+                push(Value(Type.OBJECT, Object()))
+            elif opcode == TRACE:
+                print(consts[arg])